@@ -1,4 +1,12 @@
-from .cte import CTE, with_cte, CTEManager, CTEQuerySet, With  # noqa
+from .cte import (  # noqa
+    CTE,
+    with_cte,
+    union_all,
+    fingerprint,
+    CTEManager,
+    CTEQuerySet,
+    With,
+)
 
 __version__ = "3.0.0"
-__all__ = ["CTE", "with_cte"]
+__all__ = ["CTE", "with_cte", "union_all", "fingerprint"]
@@ -0,0 +1,124 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models.sql.constants import MULTI
+
+from .jitmixin import JITMixin, jit_mixin
+from .query import get_temp_table_ctes
+from .temptable import get_reused_ctes
+
+
+def execute_batch(*querysets):
+    """Execute many querysets with as few round trips as possible
+
+    On PostgreSQL with psycopg 3 (and libpq 14 or later) the compiled
+    statements of querysets using the same database are sent at once in
+    pipeline mode, so total latency is bounded by the slowest query
+    rather than the sum of all of them. Querysets are executed one after
+    another on other databases, and when they use temporary tables
+    (CTEs with the "temp_table" strategy or `reuse_ctes()`). Each
+    statement is executed in its own transaction when autocommit is on.
+
+    :param *querysets: Querysets, normally constructed with `with_cte()`.
+    :returns: A list with a list of results for each queryset, in the
+    format of that queryset (model objects, dicts, tuples, etc.).
+    """
+    querysets = [qs._chain() for qs in querysets]
+    results = [None] * len(querysets)
+    pipelined = {}
+    for index, queryset in enumerate(querysets):
+        using = queryset.db
+        if _can_pipeline(connections[using], queryset.query):
+            pipelined.setdefault(using, []).append(index)
+        else:
+            results[index] = list(queryset)
+    for using, indexes in pipelined.items():
+        batch = [querysets[i] for i in indexes]
+        for index, result in zip(indexes, _execute_pipeline(using, batch)):
+            results[index] = result
+    return results
+
+
+async def aexecute_batch(*querysets):
+    """Async version of `execute_batch()`"""
+    return await sync_to_async(execute_batch)(*querysets)
+
+
+def _can_pipeline(connection, query):
+    if connection.vendor != "postgresql":
+        return False
+    pipeline = getattr(_get_psycopg_connection(connection), "pipeline", None)
+    if pipeline is None:
+        return False  # psycopg2
+    import psycopg
+
+    if not psycopg.Pipeline.is_supported():
+        return False
+    if not hasattr(query, "_with_ctes"):
+        return True
+    return not get_temp_table_ctes(query) and not get_reused_ctes(
+        connection.alias)
+
+
+def _get_psycopg_connection(connection):
+    connection.ensure_connection()
+    return connection.connection
+
+
+def _execute_pipeline(using, querysets):
+    connection = connections[using]
+    statements = []
+    for queryset in querysets:
+        compiler = queryset.query.get_compiler(using=using)
+        try:
+            sql, params = compiler.as_sql()
+        except EmptyResultSet:
+            sql = params = None
+        statements.append((compiler, sql, params))
+
+    cursors = []
+    results = []
+    try:
+        with connection.wrap_database_errors:
+            with _get_psycopg_connection(connection).pipeline():
+                for compiler, sql, params in statements:
+                    if sql is None:
+                        cursors.append(None)
+                        continue
+                    cursor = connection.cursor()
+                    cursors.append(cursor)
+                    cursor.execute(sql, params)
+        for queryset, (compiler, sql, params), cursor in zip(
+            querysets, statements, cursors
+        ):
+            rows = [] if cursor is None else cursor.fetchall()
+            if compiler.has_extra_select:
+                rows = [row[:compiler.col_count] for row in rows]
+            jit_mixin(compiler, BatchCompiler)._batch_rows = rows
+            jit_mixin(queryset.query, BatchQuery)._batch_compiler = compiler
+            results.append(list(queryset))
+    finally:
+        for cursor in cursors:
+            if cursor is not None:
+                cursor.close()
+    return results
+
+
+class BatchQuery(JITMixin):
+    """Query mixin returning the compiler of a batch-executed query"""
+    _jit_mixin_prefix = "Batch"
+
+    def get_compiler(self, using=None, connection=None, elide_empty=True):
+        return self._batch_compiler
+
+
+class BatchCompiler(JITMixin):
+    """Mixin for django.db.models.sql.compiler.SQLCompiler returning
+    rows fetched by `execute_batch()`
+    """
+    _jit_mixin_prefix = "Batch"
+
+    def execute_sql(self, result_type=MULTI, *args, **kwargs):
+        if result_type != MULTI:
+            return super().execute_sql(result_type, *args, **kwargs)
+        return [self._batch_rows]
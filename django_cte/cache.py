@@ -0,0 +1,227 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time_ns
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .query import canonicalize_aliases, fingerprint_sql
+from .tables import get_tables
+
+KEY_PREFIX = "django_cte"
+
+
+def cached(queryset, timeout=DEFAULT_TIMEOUT):
+    """Get results of a queryset from cache or evaluate and cache them
+
+    Results are cached in the Django cache configured with the
+    `CTE_RESULT_CACHE` setting (default: "default") and in an in-process
+    LRU cache of `CTE_RESULT_CACHE_LOCAL_SIZE` entries (default: 128, 0
+    to disable). Results from the in-process cache are shared between
+    callers and should not be modified.
+
+    Cache keys include the canonical compiled SQL, parameters, and a
+    version of each table referenced by the query. Table versions are
+    fetched from the Django cache on each call, including calls served
+    by the in-process cache, which only saves fetching and unpickling
+    results. Table versions are changed when the transaction of a
+    `post_save`, `post_delete` or `m2m_changed` signal of the models of
+    those tables is committed, which invalidates cached results. Until
+    then, queries referencing those tables are evaluated without the
+    cache on the connection of the transaction. Receivers are connected
+    for these models when a query referencing them is first cached.
+    Changes that do not send these signals (`QuerySet.update()`,
+    `bulk_create()`, raw SQL) must be followed by `invalidate()`.
+
+    :param queryset: A queryset, normally constructed with `with_cte()`.
+    :param timeout: Cache timeout in seconds. Defaults to the timeout of
+    the cache.
+    :returns: A list of results.
+    """
+    connection = connections[queryset.db]
+    query = queryset.query
+    compiler = canonicalize_aliases(query).get_compiler(connection=connection)
+    sql, params = compiler.as_sql()
+    tables = sorted(get_tables(query))
+    _watch(tables)
+    if _pending_tables(connection).intersection(tables):
+        # changed in the current transaction: do not cache uncommitted data
+        return list(queryset)
+    iterable = queryset._iterable_class
+    key = fingerprint_sql(sql, (
+        *params,
+        queryset.db,
+        f"{iterable.__module__}.{iterable.__qualname__}",
+        *get_table_versions(tables),
+    ))
+    key = f"{KEY_PREFIX}:result:{key}"
+
+    result = _local.get(key)
+    if result is not None:
+        return result
+    cache = get_cache()
+    result = cache.get(key)
+    if result is None:
+        result = list(queryset)
+        cache.set(key, result, timeout)
+    _local.set(key, result)
+    return result
+
+
+async def acached(queryset, timeout=DEFAULT_TIMEOUT):
+    """Async version of `cached()`"""
+    return await sync_to_async(cached)(queryset, timeout)
+
+
+def invalidate(*models_or_tables):
+    """Invalidate cached results of queries referencing tables
+
+    :param *models_or_tables: Model classes or table names.
+    """
+    cache = get_cache()
+    for item in models_or_tables:
+        table = item if isinstance(item, str) else item._meta.db_table
+        key = _version_key(table)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # not set: a new version is set when it is read
+            pass
+
+
+def get_table_versions(tables):
+    """Get current versions of tables
+
+    :param tables: Sequence of table names.
+    :returns: A list of versions in the order of `tables`.
+    """
+    cache = get_cache()
+    keys = [_version_key(table) for table in tables]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # time-based initial version, unlike versions of entries
+            # that may have been evicted from the cache
+            cache.add(key, time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_cache():
+    return caches[getattr(settings, "CTE_RESULT_CACHE", DEFAULT_CACHE_ALIAS)]
+
+
+def clear_local_cache():
+    """Clear the in-process result cache"""
+    _local.clear()
+
+
+def _version_key(table):
+    return f"{KEY_PREFIX}:table:{table}"
+
+
+class _LRUCache:
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = getattr(settings, "CTE_RESULT_CACHE_LOCAL_SIZE", 128)
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = _LRUCache()
+
+
+def disconnect():
+    """Disconnect signal receivers that invalidate cached results
+
+    Receivers are connected again when `cached()` is called. Connected
+    `post_delete` receivers prevent fast deletes of a model.
+    """
+    with _watch_lock:
+        for model in _watched_models:
+            uid = _dispatch_uid(model)
+            post_save.disconnect(sender=model, dispatch_uid=uid)
+            post_delete.disconnect(sender=model, dispatch_uid=uid)
+            m2m_changed.disconnect(sender=model, dispatch_uid=uid)
+        _watched_models.clear()
+        _watched_tables.clear()
+
+
+def _watch(tables):
+    """Connect signal receivers for models of tables"""
+    new = set(tables) - _watched_tables
+    if not new:
+        return
+    with _watch_lock:
+        for model in apps.get_models(include_auto_created=True):
+            if model._meta.db_table in new and model not in _watched_models:
+                uid = _dispatch_uid(model)
+                post_save.connect(_model_changed, model, dispatch_uid=uid)
+                post_delete.connect(_model_changed, model, dispatch_uid=uid)
+                m2m_changed.connect(_m2m_changed, model, dispatch_uid=uid)
+                _watched_models.add(model)
+        _watched_tables.update(new)
+
+
+def _dispatch_uid(model):
+    return f"django_cte.cache:{model._meta.label}"
+
+
+def _model_changed(sender, using, **kw):
+    transaction.on_commit(_Invalidation(sender._meta.db_table), using)
+
+
+def _m2m_changed(sender, action, using, **kw):
+    if action.startswith("post_"):
+        transaction.on_commit(_Invalidation(sender._meta.db_table), using)
+
+
+class _Invalidation:
+    """Invalidate a table when a transaction is committed"""
+
+    def __init__(self, table):
+        self.table = table
+        self.done = False
+
+    def __call__(self):
+        invalidate(self.table)
+        self.done = True
+
+
+def _pending_tables(connection):
+    """Get tables with invalidations pending until the current
+    transaction is committed (discarded when it is rolled back)
+    """
+    return {
+        func.table
+        for sids, func, *robust in connection.run_on_commit
+        if isinstance(func, _Invalidation) and not func.done
+    }
+
+
+_watched_tables = set()
+_watched_models = set()
+_watch_lock = Lock()
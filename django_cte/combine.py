@@ -0,0 +1,77 @@
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Subquery
+
+from .cte import with_cte
+from .query import generate_cte_sql
+
+
+def combine_aggregates(cte, querysets, using=None):
+    """Evaluate many aggregate querysets over a CTE in one statement
+
+    Querysets are compiled as scalar subqueries of a single `SELECT`
+    with the CTE in its `WITH` clause:
+
+        WITH RECURSIVE cte AS (...)
+        SELECT (SELECT COUNT(*) FROM cte ...) AS "count",
+               (SELECT SUM(amount) FROM cte ...) AS "total"
+
+    Each queryset must produce a single row with a single column, for
+    example `cte.queryset().filter(...).values(total=Sum("amount"))`.
+    Querysets that select only aggregates and no other fields are not
+    grouped (Django would group them by all fields of the model). Use a
+    materialized CTE to evaluate its query once for all subqueries.
+
+    :param cte: The CTE referenced by the querysets.
+    :param querysets: A dict of querysets by name.
+    :param using: Database alias. Defaults to the database on which the
+    CTE queryset would be evaluated.
+    :returns: A dict of aggregate values by name.
+    """
+    if not querysets:
+        return {}
+    subqueries = {
+        name: Subquery(_ungrouped(qs)) for name, qs in querysets.items()
+    }
+    container = with_cte(cte, select=cte.queryset().annotate(**subqueries))
+    if using is None:
+        using = container.db
+    connection = connections[using]
+    query = container.query
+    compiler = query.get_compiler(connection=connection)
+    expressions = [query.annotations[name] for name in querysets]
+
+    def as_sql():
+        qn = connection.ops.quote_name
+        columns = []
+        params = []
+        for name, expression in zip(querysets, expressions):
+            sql, expression_params = compiler.compile(expression)
+            columns.append(f"{sql} AS {qn(name)}")
+            params.extend(expression_params)
+        return f"SELECT {', '.join(columns)}", params
+
+    sql, params = generate_cte_sql(connection, query, as_sql)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    converters = compiler.get_converters(expressions)
+    if converters:
+        row = next(compiler.apply_converters([row], converters))
+    return dict(zip(querysets, row))
+
+
+async def acombine_aggregates(cte, querysets, using=None):
+    """Async version of `combine_aggregates()`"""
+    return await sync_to_async(combine_aggregates)(cte, querysets, using)
+
+
+def _ungrouped(queryset):
+    query = queryset.query
+    if query.group_by is not None and not query.values_select and all(
+        expression.contains_aggregate
+        for expression in query.annotation_select.values()
+    ):
+        queryset = queryset.all()
+        queryset.query.group_by = None
+    return queryset
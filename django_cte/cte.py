@@ -1,18 +1,26 @@
 from copy import copy
 
 import django
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.db.models import Manager, sql
 from django.db.models.expressions import Ref
 from django.db.models.query import Q, QuerySet, ValuesIterable
-from django.db.models.sql.datastructures import BaseTable
 
 from .jitmixin import jit_mixin
-from .join import QJoin, INNER
+from .join import CTETable, QJoin, INNER
 from .meta import CTEColumnRef, CTEColumns
-from .query import CTEQuery
+from .query import (
+    CTEQuery,
+    collect_ctes,
+    fingerprint_sql,
+    get_cte_compiler,
+    get_cte_query_template,
+    has_outer_ref,
+)
+from .strategy import STRATEGIES
 from ._deprecated import deprecated
 
-__all__ = ["CTE", "with_cte"]
+__all__ = ["CTE", "with_cte", "union_all", "fingerprint"]
 
 
 def with_cte(*ctes, select):
@@ -29,9 +37,58 @@ def with_cte(*ctes, select):
         select = select._default_manager.all()
     jit_mixin(select.query, CTEQuery)
     select.query._with_ctes += ctes
+    # hints are passed to database routers (see django_cte.routers)
+    # the dict is shared with other clones, so it must not be mutated
+    select._hints = {
+        **select._hints,
+        "ctes": select.query._with_ctes,
+        "cte_query": select.query,
+    }
     return select
 
 
+def union_all(*querysets):
+    """Combine querysets with UNION ALL
+
+    CTEs attached to the given querysets are collected in a single pass
+    and attached once to the combined queryset, without cloning the
+    given querysets. Prefer this over repeated `qs.union(other)` calls
+    when combining many querysets, which re-process all previously
+    combined queries on each call.
+
+    :param *querysets: One or more querysets.
+    :returns: A queryset with CTEs of all given querysets.
+    :raises ValueError: if two different CTEs have the same name.
+    """
+    if not querysets:
+        raise TypeError("union_all() requires at least one queryset")
+    ctes = collect_ctes((qs.query for qs in querysets), {})
+    first, *rest = querysets
+    # branches are not cloned: their CTEs are omitted when they are
+    # compiled as part of the combined query
+    combined = first.union(*rest, all=True) if rest else first.all()
+    attached = getattr(combined.query, "_with_ctes", ())
+    ctes = [cte for cte in ctes if cte not in attached]
+    return with_cte(*ctes, select=combined)
+
+
+def fingerprint(obj, using=DEFAULT_DB_ALIAS):
+    """Get a structural fingerprint of a CTE or queryset
+
+    The fingerprint is computed from compiled SQL and parameters. It is
+    the same for structurally identical queries, and may be used as a
+    key for caching or metrics.
+
+    :param obj: A `CTE` or queryset.
+    :param using: Database alias used to compile SQL.
+    :returns: A hex digest string.
+    """
+    if isinstance(obj, CTE):
+        return obj.fingerprint(using)
+    sql, params = obj.query.get_compiler(using=using).as_sql()
+    return fingerprint_sql(sql, params)
+
+
 class CTE:
     """Common Table Expression
 
@@ -43,35 +100,113 @@ class CTE:
     eventually be added.
     :param materialized: Optional parameter (default: False) which enforce
     using of MATERIALIZED statement for supporting databases.
+    :param columns: Optional dict of output fields: `{"name": <Field>}`.
+    Columns declared here are referenced with the given output field
+    without resolving them against the CTE query, which is faster and
+    works for recursive references. Keys must be SQL column names of
+    the CTE query.
+    :param strategy: Optional evaluation strategy (default: None, let the
+    database decide). "materialized" is the same as `materialized=True`.
+    "inline" uses NOT MATERIALIZED to inline the CTE into the query
+    referencing it. "auto" chooses between "materialized" and "inline"
+    by comparing costs estimated with EXPLAIN when the query is executed
+    (PostgreSQL only). Decisions are cached per query SQL, regardless of
+    parameters, for `CTE_STRATEGY_CACHE_TTL` seconds (default: 300).
+    "temp_table" creates a temporary table from the CTE query when the query is
+    executed, and drops it afterwards. It applies to CTEs of the
+    outermost query, other CTEs are materialized.
+    :param indexes: Optional sequence of column names or tuples of
+    column names to index on the temporary table of a "temp_table" CTE.
     """
-
-    def __init__(self, queryset, name="cte", materialized=False):
+    strategy = None
+    indexes = ()
+
+    def __init__(
+        self,
+        queryset,
+        name="cte",
+        materialized=False,
+        columns=None,
+        strategy=None,
+        indexes=(),
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown CTE strategy: {strategy!r}")
+        if indexes and strategy != "temp_table":
+            raise ValueError("CTE indexes require strategy='temp_table'")
         self._set_queryset(queryset)
         self.name = name
         self.col = CTEColumns(self)
         self.materialized = materialized
+        self.columns = columns
+        self.strategy = strategy
+        self.indexes = tuple(
+            (index,) if isinstance(index, str) else tuple(index)
+            for index in indexes
+        )
 
     def __getstate__(self):
-        return (self.query, self.name, self.materialized, self._iterable_class)
+        return (
+            self.query,
+            self.name,
+            self.materialized,
+            self._iterable_class,
+            self.columns,
+            self.strategy,
+            self.indexes,
+        )
 
     def __setstate__(self, state):
+        self.columns = None
+        self.strategy = None
+        self.indexes = ()
         if len(state) == 3:
             # Keep compatibility with the previous serialization method
             self.query, self.name, self.materialized = state
             self._iterable_class = ValuesIterable
-        else:
+        elif len(state) == 4:
             self.query, self.name, self.materialized, self._iterable_class = state
+        else:
+            (
+                self.query,
+                self.name,
+                self.materialized,
+                self._iterable_class,
+                self.columns,
+                self.strategy,
+                self.indexes,
+            ) = state
         self.col = CTEColumns(self)
 
     def __repr__(self):
         return f"<{type(self).__name__} {self.name}>"
 
+    @property
+    def query(self):
+        return self._query
+
+    @query.setter
+    def query(self, query):
+        self._query = query
+        # column resolution caches, keyed by column name
+        self._refs = {}
+        self._output_fields = {}
+        self._has_outer_ref = None
+
     def _set_queryset(self, queryset):
         self.query = None if queryset is None else queryset.query
         self._iterable_class = getattr(queryset, "_iterable_class", ValuesIterable)
 
     @classmethod
-    def recursive(cls, make_cte_queryset, name="cte", materialized=False):
+    def recursive(
+        cls,
+        make_cte_queryset,
+        name="cte",
+        materialized=False,
+        columns=None,
+        strategy=None,
+        indexes=(),
+    ):
         """Recursive Common Table Expression
 
         :param make_cte_queryset: Function taking a single argument (a
@@ -80,9 +215,12 @@ class CTE:
         statement unioned with a recursive statement.
         :param name: See `name` parameter of `__init__`.
         :param materialized: See `materialized` parameter of `__init__`.
+        :param columns: See `columns` parameter of `__init__`.
+        :param strategy: See `strategy` parameter of `__init__`.
+        :param indexes: See `indexes` parameter of `__init__`.
         :returns: The fully constructed recursive cte object.
         """
-        cte = cls(None, name, materialized)
+        cte = cls(None, name, materialized, columns, strategy, indexes)
         cte._set_queryset(make_cte_queryset(cte))
         return cte
 
@@ -125,6 +263,7 @@ class CTE:
 
         parent = query.get_initial_alias()
         query.join(QJoin(parent, self.name, self.name, on_clause, join_type))
+        self._add_reference(query)
         return queryset
 
     def queryset(self):
@@ -143,7 +282,8 @@ class CTE:
         qs._fields = ()  # Allow any field names to be used in further annotations
 
         query = jit_mixin(sql.Query(cte_query.model), CTEQuery)
-        query.join(BaseTable(self.name, None))
+        query.join(CTETable(self.name, None))
+        self._add_reference(query)
         query.default_cols = cte_query.default_cols
         query.deferred_loading = cte_query.deferred_loading
 
@@ -152,14 +292,15 @@ class CTE:
 
         if cte_query.annotations:
             for alias, value in cte_query.annotations.items():
-                col = CTEColumnRef(alias, self.name, value.output_field)
+                output_field = self._declared_field(alias) or value.output_field
+                col = CTEColumnRef(alias, self.name, output_field)
                 query.add_annotation(col, alias)
         query.annotation_select_mask = cte_query.annotation_select_mask
 
         if selected := getattr(cte_query, "selected", None):
             for alias in selected:
                 if alias not in cte_query.annotations:
-                    output_field = cte_query.resolve_ref(alias).output_field
+                    output_field = self._output_field(alias)
                     col = CTEColumnRef(alias, self.name, output_field)
                     query.add_annotation(col, alias)
             query.selected = {alias: alias for alias in selected}
@@ -167,8 +308,61 @@ class CTE:
         qs.query = query
         return qs
 
+    def fingerprint(self, using=DEFAULT_DB_ALIAS):
+        """Get a structural fingerprint of this CTE's query
+
+        CTEs with identical queries have the same fingerprint, even if
+        their names differ.
+
+        :param using: Database alias used to compile SQL.
+        :returns: A hex digest string.
+        """
+        if self.query is None:
+            raise ValueError("Cannot fingerprint recursive CTE without a query.")
+        compiler = get_cte_compiler(self, connections[using])
+        sql, params = compiler.as_sql()
+        template = get_cte_query_template(self)
+        return fingerprint_sql(template.format(name="", query=sql), params)
+
+    def _add_reference(self, query):
+        # CTEs referenced by name in a query, used to resolve them to the
+        # tables they read (see django_cte.tables). A recursive CTE
+        # referencing itself has no query yet, and is not recorded to
+        # avoid a reference cycle.
+        query._cte_refs = {
+            **getattr(query, "_cte_refs", {}),
+            self.name: None if self.query is None else self,
+        }
+
+    def _declared_field(self, name):
+        return self.columns.get(name) if self.columns else None
+
+    def _output_field(self, name):
+        try:
+            return self._output_fields[name]
+        except KeyError:
+            pass
+        field = self._declared_field(name)
+        if field is not None:
+            return field
+        field = self.query.resolve_ref(name).output_field
+        self._output_fields[name] = field
+        return field
+
     def _resolve_ref(self, column):
+        try:
+            return self._refs[column.name]
+        except KeyError:
+            pass
+        ref = self._refs[column.name] = self._make_ref(column)
+        return ref
+
+    def _make_ref(self, column):
         name = column.name
+        field = self._declared_field(name)
+        if field is not None:
+            return CTEColumnRef(name, self.name, field)
+
         ref = self.query.resolve_ref(name)
         if ref is column or column in ref.get_source_expressions():
             raise ValueError(f"Circular reference: {column} = {ref}")
@@ -182,9 +376,17 @@ class CTE:
 
         return ref
 
+    def _references_outer_query(self):
+        if self._has_outer_ref is None:
+            self._has_outer_ref = has_outer_ref(self.query)
+        return self._has_outer_ref
+
     def resolve_expression(self, *args, **kw):
         if self.query is None:
             raise ValueError("Cannot resolve recursive CTE without a query.")
+        if not self._references_outer_query():
+            # nothing to resolve, the CTE can be shared as is
+            return self
         clone = copy(self)
         clone.query = clone.query.resolve_expression(*args, **kw)
         return clone
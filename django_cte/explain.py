@@ -0,0 +1,147 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+from .query import find_hoistable_ctes
+
+
+def cte_explain(queryset, analyze=True, format="json"):
+    """Explain a query and break down the plan by CTE
+
+    On PostgreSQL the plan is produced with `EXPLAIN (FORMAT JSON)`,
+    with `ANALYZE` and `BUFFERS` if `analyze` is true, which executes
+    the query. Each CTE is mapped to its plan node (the "CTE <name>"
+    init plan) and to the "CTE Scan" nodes reading it. On SQLite the
+    plan is produced with `EXPLAIN QUERY PLAN`, and CTEs are mapped to
+    "MATERIALIZE <name>" or "CO-ROUTINE <name>" nodes and the nodes
+    scanning them. SQLite does not report costs or timings.
+
+    :param queryset: A queryset, normally constructed with `with_cte()`.
+    :param analyze: Execute the query to get actual timings, row counts
+    and buffer usage (PostgreSQL only).
+    :param format: Plan format. Only "json" is supported.
+    :returns: A dict with keys "plan" (parsed plan) and "ctes" (dict
+    of CTE name to a dict with keys "name", "inlined", "node", "scans"
+    and plan statistics). "inlined" is true if the CTE has no node of
+    its own in the plan because the database inlined it in the query
+    that references it.
+    """
+    if format != "json":
+        raise ValueError(f"Unsupported format: {format!r}")
+    query = queryset.query
+    names = [cte.name for cte in getattr(query, "_with_ctes", ())]
+    names.extend(cte.name for cte, owner in find_hoistable_ctes(query))
+    vendor = connections[queryset.db].vendor
+    if vendor == "postgresql":
+        options = {"analyze": True, "buffers": True} if analyze else {}
+        plan = json.loads(queryset.explain(format="json", **options))
+        ctes = _postgres_ctes(plan)
+    elif vendor == "sqlite":
+        plan = _sqlite_plan(queryset.explain())
+        ctes = _sqlite_ctes(plan)
+    else:
+        raise ValueError(f"cte_explain() is not supported on {vendor}")
+    return {
+        "plan": plan,
+        "ctes": {
+            name: ctes.get(name) or {
+                "name": name,
+                "inlined": True,
+                "node": None,
+                "scans": [],
+            }
+            for name in names
+        },
+    }
+
+
+async def acte_explain(queryset, analyze=True, format="json"):
+    """Async version of `cte_explain()`"""
+    return await sync_to_async(cte_explain)(queryset, analyze, format)
+
+
+_postgres_stats = {
+    "Startup Cost": "startup_cost",
+    "Total Cost": "total_cost",
+    "Plan Rows": "plan_rows",
+    "Actual Startup Time": "actual_startup_time",
+    "Actual Total Time": "actual_total_time",
+    "Actual Rows": "actual_rows",
+    "Actual Loops": "actual_loops",
+    "Shared Hit Blocks": "shared_hit_blocks",
+    "Shared Read Blocks": "shared_read_blocks",
+    "Shared Written Blocks": "shared_written_blocks",
+    "Temp Read Blocks": "temp_read_blocks",
+    "Temp Written Blocks": "temp_written_blocks",
+}
+
+
+def _postgres_stats_of(node):
+    return {
+        key: node[pg_key]
+        for pg_key, key in _postgres_stats.items()
+        if pg_key in node
+    }
+
+
+def _postgres_ctes(plan):
+    ctes = {}
+    scans = {}
+
+    def walk(node):
+        subplan = node.get("Subplan Name", "")
+        if subplan.startswith("CTE "):
+            name = subplan[4:]
+            ctes[name] = {
+                "name": name,
+                "inlined": False,
+                "node": node,
+                **_postgres_stats_of(node),
+            }
+        if node.get("Node Type") == "CTE Scan":
+            scans.setdefault(node["CTE Name"], []).append(node)
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    for item in plan:
+        walk(item["Plan"])
+    for name, info in ctes.items():
+        info["scans"] = [_postgres_stats_of(n) for n in scans.get(name, [])]
+    return ctes
+
+
+def _sqlite_plan(text):
+    """Parse EXPLAIN QUERY PLAN output into a tree of nodes"""
+    root = {"id": 0, "detail": "QUERY PLAN", "children": []}
+    nodes = {0: root}
+    for line in text.splitlines():
+        id_, parent, _, detail = line.split(" ", 3)
+        node = {"id": int(id_), "detail": detail, "children": []}
+        nodes[node["id"]] = node
+        nodes.get(int(parent), root)["children"].append(node)
+    return root
+
+
+def _sqlite_ctes(plan):
+    ctes = {}
+    scans = {}
+
+    def walk(node):
+        kind, _, rest = node["detail"].partition(" ")
+        if kind in ("MATERIALIZE", "CO-ROUTINE"):
+            ctes[rest] = {
+                "name": rest,
+                "inlined": False,
+                "node": node,
+                "materialized": kind == "MATERIALIZE",
+            }
+        elif kind in ("SCAN", "SEARCH"):
+            scans.setdefault(rest.split(" ", 1)[0], []).append(node)
+        for child in node["children"]:
+            walk(child)
+
+    walk(plan)
+    for name, info in ctes.items():
+        info["scans"] = scans.get(name, [])
+    return ctes
@@ -1,4 +1,38 @@
+from contextvars import ContextVar
+
 from django.db.models.sql.constants import INNER
+from django.db.models.sql.datastructures import BaseTable
+
+# names of CTEs dropped from the statement being compiled, mapped to the
+# name of the CTE with the same query, which is referenced instead
+cte_renames = ContextVar("django_cte_renames", default={})
+
+
+def _table_sql(compiler, connection, table_name, table_alias):
+    name = cte_renames.get().get(table_name)
+    if name is None:
+        if table_alias == table_name:
+            alias = ''
+        else:
+            alias = ' %s' % table_alias
+        return compiler.quote_name_unless_alias(table_name) + alias
+    qn = connection.ops.quote_name
+    if table_alias == table_name:
+        # columns reference the quoted name of the dropped CTE
+        table_alias = qn(table_alias)
+    return '%s %s' % (qn(name), table_alias)
+
+
+class CTETable(BaseTable):
+    """CTE reference in FROM clause
+
+    The referenced CTE is renamed if it was dropped from the statement
+    because another CTE has the same query.
+    """
+
+    def as_sql(self, compiler, connection):
+        return _table_sql(
+            compiler, connection, self.table_name, self.table_alias), []
 
 
 class QJoin:
@@ -46,15 +80,10 @@ class QJoin:
     def as_sql(self, compiler, connection):
         """Generate join clause SQL"""
         on_clause_sql, params = self.on_clause.as_sql(compiler, connection)
-        if self.table_alias == self.table_name:
-            alias = ''
-        else:
-            alias = ' %s' % self.table_alias
-        qn = compiler.quote_name_unless_alias
-        sql = '%s %s%s ON %s' % (
+        sql = '%s %s ON %s' % (
             self.join_type,
-            qn(self.table_name),
-            alias,
+            _table_sql(
+                compiler, connection, self.table_name, self.table_alias),
             on_clause_sql
         )
         return sql, params
@@ -35,11 +35,12 @@ class CTEColumn(Expression):
 
     @property
     def _ref(self):
-        if self._cte.query is None:
+        if self._cte.query is None and self._cte._declared_field(self.name) is None:
             raise ValueError(
                 "cannot resolve '{cte}.{name}' in recursive CTE setup. "
-                "Hint: use ExpressionWrapper({cte}.col.{name}, "
-                "output_field=...)".format(cte=self._cte.name, name=self.name)
+                "Hint: declare CTE(..., columns={{'{name}': ...}}) or use "
+                "ExpressionWrapper({cte}.col.{name}, output_field=...)"
+                .format(cte=self._cte.name, name=self.name)
             )
 
         ref = self._cte._resolve_ref(self)
@@ -56,11 +57,15 @@ class CTEColumn(Expression):
     def output_field(self):
         # required to fix error caused by django commit
         #     9d519d3dc4e5bd1d9ff3806b44624c3e487d61c1
-        if self._cte.query is None:
-            raise AttributeError
-
         if self._output_field is not None:
             return self._output_field
+
+        field = self._cte._declared_field(self.name)
+        if field is not None:
+            return field
+
+        if self._cte.query is None:
+            raise AttributeError
         return self._ref.output_field
 
     def as_sql(self, compiler, connection):
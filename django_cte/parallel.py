@@ -0,0 +1,162 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from itertools import chain
+
+from django.db import connections
+from django.db.models import Q
+
+COMBINE = {
+    "sum": lambda a, b: b if a is None else a if b is None else a + b,
+    "count": lambda a, b: (a or 0) + (b or 0),
+    "min": lambda a, b: b if a is None else a if b is None else min(a, b),
+    "max": lambda a, b: b if a is None else a if b is None else max(a, b),
+}
+
+
+def execute_partitioned(
+    queryset,
+    cte,
+    partitions,
+    executor=None,
+    max_workers=None,
+    aggregates=None,
+):
+    """Execute a CTE query in partitions in parallel
+
+    A copy of the queryset is made for each partition, in which the
+    partition filter is added to the query of the CTE, and the copies
+    are executed concurrently, each on its own database connection.
+    Results are produced in partition order as partitions complete.
+
+    Partitions must not overlap, and the CTE must produce each output
+    row from rows of a single partition (for example, when it is
+    grouped by the partition key), otherwise results will differ from
+    the results of the original queryset.
+
+    :param queryset: A queryset constructed with `with_cte()`.
+    :param cte: A CTE of the queryset, to which partition filters are
+    added. It must not be recursive or combined with `union()`, etc.
+    :param partitions: A sequence of `Q` objects. See `partition_ranges()`.
+    :param executor: Optional `concurrent.futures.Executor` used to
+    execute partitions. A `ThreadPoolExecutor` with `max_workers`
+    threads is used by default.
+    :param max_workers: Number of threads of the default executor.
+    Defaults to the number of partitions.
+    :param aggregates: Optional dict of aggregate functions ("sum",
+    "count", "min" or "max") by column name, used to combine the rows
+    of partitions (which must be dicts, as returned by `values()`) with
+    equal values in all other columns.
+    :returns: An iterator of results in the format of the queryset.
+    """
+    if cte not in getattr(queryset.query, "_with_ctes", ()):
+        raise ValueError(f"{cte!r} is not a CTE of the queryset")
+    if cte.query.combinator:
+        raise ValueError(f"Cannot partition combined query of {cte!r}")
+    if aggregates:
+        unknown = set(aggregates.values()) - COMBINE.keys()
+        if unknown:
+            raise ValueError(f"Unknown aggregate functions: {sorted(unknown)}")
+    querysets = [_partition(queryset, cte, q) for q in partitions]
+    results = chain.from_iterable(
+        execute_all(querysets, executor, max_workers))
+    if aggregates:
+        results = reaggregate(results, aggregates)
+    return results
+
+
+def partition_ranges(field, bounds):
+    """Get filters partitioning a field into ranges
+
+    :param field: Field name (lookups such as "created__date" are
+    allowed).
+    :param bounds: Sorted sequence of range bounds. A range includes
+    its lower bound and excludes its upper bound. Use `None` as first
+    or last bound for an open range.
+    :returns: A list of `Q` objects, one per range.
+    """
+    if len(bounds) < 2:
+        raise ValueError("At least two bounds are required")
+    partitions = []
+    for low, high in zip(bounds, bounds[1:]):
+        lookups = {}
+        if low is not None:
+            lookups[f"{field}__gte"] = low
+        if high is not None:
+            lookups[f"{field}__lt"] = high
+        partitions.append(Q(**lookups))
+    return partitions
+
+
+def reaggregate(rows, aggregates):
+    """Combine aggregate values of rows with equal values in other columns
+
+    :param rows: Iterable of dicts.
+    :param aggregates: Dict of aggregate functions ("sum", "count",
+    "min" or "max") by column name.
+    :returns: A list of dicts, in the order in which their group was
+    first seen.
+    """
+    groups = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError(
+                f"Cannot re-aggregate {type(row).__name__} rows. "
+                "Use values() to get dicts."
+            )
+        key = tuple(
+            (name, value) for name, value in row.items()
+            if name not in aggregates
+        )
+        group = groups.get(key)
+        if group is None:
+            groups[key] = dict(row)
+            continue
+        for name, function in aggregates.items():
+            group[name] = COMBINE[function](group[name], row[name])
+    return list(groups.values())
+
+
+def _partition(queryset, cte, q):
+    part = copy(cte)
+    query = cte.query.chain()
+    query.add_q(q)
+    part.query = query
+    queryset = queryset.all()
+    queryset.query._with_ctes = tuple(
+        part if item is cte else item for item in queryset.query._with_ctes
+    )
+    return queryset
+
+
+def execute_all(querysets, executor=None, max_workers=None):
+    """Execute querysets concurrently
+
+    :param querysets: Querysets, each executed on a connection of the
+    thread in which it runs.
+    :param executor: Optional `concurrent.futures.Executor`. A
+    `ThreadPoolExecutor` with `max_workers` threads is used by default.
+    :param max_workers: Number of threads of the default executor.
+    Defaults to the number of querysets.
+    :returns: An iterator of result lists, one per queryset, in the
+    order of the querysets.
+    """
+    caller = threading.get_ident()
+
+    def run(queryset):
+        try:
+            return list(queryset)
+        finally:
+            if threading.get_ident() != caller:
+                connections[queryset.db].close()
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers or len(querysets) or 1)
+    try:
+        futures = [executor.submit(run, qs) for qs in querysets]
+        for future in futures:
+            yield future.result()
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
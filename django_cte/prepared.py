@@ -0,0 +1,303 @@
+import datetime
+import math
+import re
+from contextvars import ContextVar
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Expression
+from django.db.models.sql.constants import MULTI
+
+from .jitmixin import JITMixin, jit_mixin
+from .query import fingerprint_sql
+
+
+def prepared(queryset):
+    """Compile a queryset once to be executed many times
+
+    On PostgreSQL the compiled SQL is prepared on the server with
+    `PREPARE` (once per database connection), and executed with
+    `EXECUTE`, which skips parsing and planning on repeated
+    executions. Other databases execute the compiled SQL.
+
+    :param queryset: A queryset, normally constructed with `with_cte()`.
+    :returns: A `PreparedQuery` object.
+    """
+    return PreparedQuery(queryset)
+
+
+class PreparedQuery:
+    """Queryset compiled to SQL, which can be executed many times
+
+    Results are returned in the format of the original queryset (model
+    objects, dicts, tuples, etc.). A prepared query is bound to the
+    database alias of the queryset.
+
+    :param queryset: A queryset.
+    """
+
+    def __init__(self, queryset):
+        queryset = queryset.using(queryset.db)
+        compiler = queryset.query.get_compiler(using=queryset.db)
+        self.sql, self.params = compiler.as_sql()
+        self._compiler = jit_mixin(compiler, PreparedCompiler)
+        self._compiler._prepared = self
+        self._compiler._params = self.params
+        self._queryset = queryset
+        query = jit_mixin(queryset.query, PreparedQueryMixin)
+        query._prepared_compiler = self._compiler
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.sql}>"
+
+    def execute(self, params=None):
+        """Execute the query
+
+        :param params: Optional sequence of parameters to use instead of
+        the parameters of the original queryset. Parameters must be in
+        the same order as in `self.params`, and be adapted for the
+        database (as returned by `Field.get_db_prep_value()`).
+        :returns: A list of results.
+        """
+        if params is None:
+            params = self.params
+        elif len(params) != len(self.params):
+            raise ValueError(
+                f"Expected {len(self.params)} parameters, got {len(params)}"
+            )
+        queryset = self._queryset
+        # parameters of this call are passed to the compiler returned by
+        # PreparedQueryMixin.get_compiler(), which is not shared between
+        # calls, so concurrent calls cannot see each other's parameters
+        token = _call_params.set((self, tuple(params)))
+        try:
+            return list(queryset._iterable_class(queryset))
+        finally:
+            _call_params.reset(token)
+
+    async def aexecute(self, params=None):
+        """Async version of `execute()`"""
+        return await sync_to_async(self.execute)(params)
+
+    def get_statement(self, connection, params, chunked_fetch=False):
+        """Get SQL and parameters to execute on the given connection"""
+        if connection.vendor != "postgresql" or (
+            # server-side (named) cursors cannot be declared for EXECUTE
+            chunked_fetch
+            and not connection.settings_dict.get("DISABLE_SERVER_SIDE_CURSORS")
+        ):
+            return self.sql, params
+        name = prepare_statement(connection, self.sql, params)
+        return execute_statement_sql(name, params), params
+
+
+def template(queryset):
+    """Compile a queryset with named placeholders once to be executed
+    many times with different values
+
+    :param queryset: A queryset, normally constructed with `with_cte()`,
+    that uses `Placeholder` expressions in place of values.
+    :returns: A `QueryTemplate` object.
+    """
+    return QueryTemplate(queryset)
+
+
+class QueryTemplate(PreparedQuery):
+    """Queryset compiled to SQL with named parameter slots
+
+    Placeholder values are bound to parameter slots on each execution
+    without building or compiling the queryset again.
+
+    :param queryset: A queryset with `Placeholder` expressions.
+    """
+
+    def __init__(self, queryset):
+        super().__init__(queryset)
+        self.slots = {}
+        for index, param in enumerate(self.params):
+            if isinstance(param, Slot):
+                self.slots.setdefault(param.name, []).append(index)
+
+    def execute(self, **values):
+        """Execute the query
+
+        :param **values: Placeholder values by name.
+        :returns: A list of results.
+        """
+        missing = self.slots.keys() - values.keys()
+        unknown = values.keys() - self.slots.keys()
+        if missing or unknown:
+            raise ValueError(
+                f"Missing placeholder values: {sorted(missing)}"
+                if missing else f"Unknown placeholders: {sorted(unknown)}"
+            )
+        connection = self._compiler.connection
+        params = list(self.params)
+        for name, indexes in self.slots.items():
+            slot = params[indexes[0]]
+            value = slot.get_db_prep_value(values[name], connection)
+            for index in indexes:
+                params[index] = value
+        return super().execute(params)
+
+    async def aexecute(self, **values):
+        """Async version of `execute()`"""
+        return await sync_to_async(self.execute)(**values)
+
+
+class Placeholder(Expression):
+    """Named value to be bound when a `QueryTemplate` is executed
+
+    :param name: Placeholder name. Values are passed to
+    `QueryTemplate.execute()` as keyword arguments with this name.
+    :param output_field: Optional field used to adapt values for the
+    database. Values are passed to the database as is if omitted.
+    """
+
+    def __init__(self, name, output_field=None):
+        super().__init__(output_field=output_field)
+        self.name = name
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+    def as_sql(self, compiler, connection):
+        field = self._output_field_or_none
+        return "%s", [Slot(self.name, field)]
+
+
+class Slot:
+    """Parameter slot of a compiled `Placeholder`"""
+    __slots__ = ("name", "field")
+
+    def __init__(self, name, field=None):
+        self.name = name
+        self.field = field
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+    def get_db_prep_value(self, value, connection):
+        if self.field is None:
+            return value
+        return self.field.get_db_prep_value(value, connection)
+
+
+class PreparedQueryMixin(JITMixin):
+    """Query mixin returning the compiler of a prepared query"""
+    _jit_mixin_prefix = "Prepared"
+
+    def get_compiler(self, using=None, connection=None, elide_empty=True):
+        compiler = self._prepared_compiler
+        if connection is None:
+            connection = (
+                compiler.connection if using is None else connections[using]
+            )
+        if connection.alias != compiler.connection.alias:
+            return super().get_compiler(using, connection, elide_empty)
+        prepared, params = _call_params.get()
+        if prepared is not compiler._prepared:
+            params = compiler._params
+        # copy of the compiler for a single execution, possibly on the
+        # connection of another thread (e.g., with sync_to_async)
+        clone = object.__new__(type(compiler))
+        clone.__dict__.update(
+            compiler.__dict__, connection=connection, _params=params)
+        return clone
+
+
+class PreparedCompiler(JITMixin):
+    """Mixin for django.db.models.sql.compiler.SQLCompiler"""
+    _jit_mixin_prefix = "Prepared"
+    _statement = None
+
+    def as_sql(self, *args, **kwargs):
+        if self._statement is None:
+            return self._prepared.sql, self._params
+        return self._statement
+
+    def execute_sql(self, result_type=MULTI, chunked_fetch=False, *args, **kw):
+        self._statement = self._prepared.get_statement(
+            self.connection, self._params, chunked_fetch)
+        try:
+            return super().execute_sql(result_type, chunked_fetch, *args, **kw)
+        finally:
+            self._statement = None
+
+
+def prepare_statement(connection, sql, params):
+    """Prepare SQL on a PostgreSQL connection
+
+    Statements are prepared once per database connection. They are
+    dropped by the database server when the connection is closed.
+
+    :returns: Prepared statement name.
+    """
+    types = [_get_param_type(p) for p in params]
+    name = "django_cte_" + fingerprint_sql(sql, types)[:20]
+    names = _get_prepared_names(connection)
+    if name not in names:
+        with connection.cursor() as cursor:
+            cursor.execute(get_prepare_sql(name, sql, types))
+        names.add(name)
+    return name
+
+
+def get_prepare_sql(name, sql, types):
+    """Get PREPARE statement for SQL with %s placeholders"""
+    numbers = iter(range(1, len(types) + 1))
+
+    def number(match):
+        return "%" if match.group(1) == "%" else f"${next(numbers)}"
+
+    types = f" ({', '.join(types)})" if types else ""
+    return f"PREPARE {name}{types} AS {_placeholder.sub(number, sql)}"
+
+
+def execute_statement_sql(name, params):
+    if not params:
+        return f"EXECUTE {name}"
+    return f"EXECUTE {name} ({', '.join(['%s'] * len(params))})"
+
+
+_placeholder = re.compile(r"%([%s])")
+_call_params = ContextVar("django_cte_prepared_params", default=(None, None))
+
+
+def _get_param_type(value):
+    # Types of numbers are those of the literals passed in unprepared
+    # SQL, so that functions and operators are resolved the same way
+    # (e.g., LEFT(text, integer) has no bigint variant). "unknown"
+    # does not work for numbers: an unknown parameter multiplied by an
+    # integer column is inferred as integer (1.5 -> 2), and ambiguous
+    # functions such as SUBSTRING may be resolved as their text variant.
+    # Other "unknown" types are inferred by the server from the context
+    # in which the parameter is used.
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        if -2**31 <= value < 2**31:
+            return "integer"
+        if -2**63 <= value < 2**63:
+            return "bigint"
+        return "numeric"
+    if isinstance(value, float):
+        return "numeric" if math.isfinite(value) else "double precision"
+    if isinstance(value, Decimal):
+        return "numeric"
+    if isinstance(value, datetime.datetime):
+        return "timestamptz" if value.tzinfo is not None else "timestamp"
+    if isinstance(value, datetime.date):
+        return "date"
+    return "unknown"
+
+
+def _get_prepared_names(connection):
+    connection.ensure_connection()
+    raw = connection.connection
+    registry = getattr(connection, "_cte_prepared_statements", None)
+    if registry is None or registry[0] is not raw:
+        # new database connection: no statements prepared yet
+        registry = connection._cte_prepared_statements = (raw, set())
+    return registry[1]
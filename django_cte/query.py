@@ -1,9 +1,22 @@
+import hashlib
+import re
+import sys
+from contextvars import ContextVar
+from time import perf_counter
+
 import django
+from django.conf import settings
 from django.core.exceptions import EmptyResultSet
-from django.db.models.sql.constants import LOUTER
+from django.db import transaction
+from django.db.models.expressions import OuterRef, ResolvedOuterRef
+from django.db.models.sql import Query
+from django.db.models.sql.constants import LOUTER, MULTI
 
 from .jitmixin import JITMixin, jit_mixin
-from .join import QJoin
+from .join import QJoin, cte_renames
+from .signals import cte_compiled, cte_query_compiled
+from .strategy import choose_strategies
+from .temptable import create_temp_table, drop_temp_table, get_reused_ctes
 
 # NOTE: it is currently not possible to execute delete queries that
 # reference CTEs without patching `QuerySet.delete` (Django method)
@@ -22,41 +35,31 @@ class CTEQuery(JITMixin):
 
     @combined_queries.setter
     def combined_queries(self, queries):
-        ctes = []
+        # CTEs of combined queries are moved to the WITH clause of this
+        # query. They are omitted when the combined queries are compiled
+        # as part of this query (see generate_cte_sql()), so the queries
+        # are not cloned to remove them.
         seen = {cte.name: cte for cte in self._with_ctes}
-        for query in queries:
-            for cte in getattr(query, "_with_ctes", ()):
-                if seen.get(cte.name) is cte:
-                    continue
-                if cte.name in seen:
-                    raise ValueError(
-                        f"Found two or more CTEs named '{cte.name}'. "
-                        "Hint: assign a unique name to each CTE."
-                    )
-                ctes.append(cte)
-                seen[cte.name] = cte
-
-        if seen:
-            def without_ctes(query):
-                if getattr(query, "_with_ctes", None):
-                    query = query.clone()
-                    del query._with_ctes
-                return query
-
-            self._with_ctes += tuple(ctes)
-            queries = tuple(without_ctes(q) for q in queries)
+        self._with_ctes += tuple(collect_ctes(queries, seen))
         self.__dict__["combined_queries"] = queries
 
     def resolve_expression(self, *args, **kwargs):
         clone = super().resolve_expression(*args, **kwargs)
-        clone._with_ctes = tuple(
+        ctes = tuple(
             cte.resolve_expression(*args, **kwargs)
             for cte in clone._with_ctes
         )
+        if any(a is not b for a, b in zip(ctes, clone._with_ctes)):
+            clone._with_ctes = ctes
         return clone
 
     def get_compiler(self, *args, **kwargs):
-        return jit_mixin(super().get_compiler(*args, **kwargs), CTECompiler)
+        query = self
+        if canonical_sql_enabled() and not self.subquery:
+            # CTE_CANONICAL_SQL: compile a clone with renumbered aliases
+            query = canonicalize_aliases(self)
+        compiler = super(CTEQuery, query).get_compiler(*args, **kwargs)
+        return jit_mixin(compiler, CTECompiler)
 
     def chain(self, klass=None):
         clone = jit_mixin(super().chain(klass), CTEQuery)
@@ -64,37 +67,217 @@ class CTEQuery(JITMixin):
         return clone
 
 
-def generate_cte_sql(connection, query, as_sql):
-    if not query._with_ctes:
-        return as_sql()
+def collect_ctes(queries, seen):
+    """Collect CTEs attached to the given queries
 
+    :param queries: Iterable of queries.
+    :param seen: Dict of CTEs by name, which have already been
+    collected. CTEs found in `queries` are added to this dict.
+    :returns: A list of CTEs not previously in `seen`.
+    :raises ValueError: if two different CTEs have the same name.
+    """
     ctes = []
-    params = []
-    for cte in query._with_ctes:
-        if django.VERSION > (4, 2):
-            _ignore_with_col_aliases(cte.query)
+    for query in queries:
+        for cte in getattr(query, "_with_ctes", ()):
+            if seen.get(cte.name) is cte:
+                continue
+            if cte.name in seen:
+                raise ValueError(
+                    f"Found two or more CTEs named '{cte.name}'. "
+                    "Hint: assign a unique name to each CTE."
+                )
+            ctes.append(cte)
+            seen[cte.name] = cte
+    return ctes
+
+
+def walk(query, depth=0):
+    """Iterate over all expressions and nested queries of a query
+
+    Expressions of join conditions, `where`, annotations, `select`,
+    `group_by` and `order_by` are visited. CTE bodies and combined
+    queries are at the same depth as the query to which they belong.
+    Queries nested in expressions (subqueries) are one level deeper.
+
+    :yields: `(node, depth)` pairs, where `node` is a query or an
+    expression.
+    """
+    yield query, depth
+    for cte in getattr(query, "_with_ctes", ()):
+        if cte.query is not None:
+            yield from walk(cte.query, depth)
+    for combined in getattr(query, "combined_queries", ()):
+        yield from walk(combined, depth)
+    for join in getattr(query, "alias_map", {}).values():
+        on_clause = getattr(join, "on_clause", None)  # QJoin (CTE join)
+        if on_clause is not None:
+            yield from _walk_expression(on_clause, depth)
+    where = getattr(query, "where", None)
+    if where is not None:
+        yield from _walk_expression(where, depth)
+    for annotation in getattr(query, "annotations", {}).values():
+        yield from _walk_expression(annotation, depth)
+    group_by = getattr(query, "group_by", None)
+    for expressions in (
+        getattr(query, "select", ()),
+        group_by if isinstance(group_by, tuple) else (),
+        getattr(query, "order_by", ()),
+    ):
+        for expression in expressions:
+            # order_by may contain field names
+            if not isinstance(expression, str):
+                yield from _walk_expression(expression, depth)
+
+
+def _walk_expression(expression, depth):
+    if isinstance(expression, Query):
+        yield from walk(expression, depth + 1)
+        return
+    yield expression, depth
+    nested = getattr(expression, "query", None)
+    if isinstance(nested, Query):
+        # Subquery, Exists
+        yield from walk(nested, depth + 1)
+    for source in getattr(expression, "get_source_expressions", list)():
+        if source is not None:
+            yield from _walk_expression(source, depth)
+
+
+def has_outer_ref(query):
+    """Check if query references columns of an outer query"""
+    for node, depth in walk(query):
+        if isinstance(node, OuterRef):
+            return True
+        if depth == 0:
+            if isinstance(node, ResolvedOuterRef):
+                return True
+            # outer references are resolved to columns of external aliases
+            if (
+                isinstance(node, Query)
+                and node.external_aliases
+                and node.get_external_cols()
+            ):
+                return True
+    return False
+
+
+# CTEs in the WITH clause of the outermost statement being compiled
+_statement_ctes = ContextVar("django_cte_statement_ctes", default=None)
+# CTEs that exist as temporary tables while a statement is executed
+_temp_table_ctes = ContextVar("django_cte_temp_table_ctes", default=())
+# outermost query being executed, for which "auto" strategies are chosen
+_executing_query = ContextVar("django_cte_executing_query", default=None)
 
-        alias = query.alias_map.get(cte.name)
-        should_elide_empty = (
-                not isinstance(alias, QJoin) or alias.join_type != LOUTER
-        )
 
-        compiler = cte.query.get_compiler(
-            connection=connection, elide_empty=should_elide_empty
-        )
+def generate_cte_sql(connection, query, as_sql):
+    statement_ctes = _statement_ctes.get()
+    if statement_ctes is not None:
+        # nested query: CTEs hoisted to the outermost statement are omitted
+        temp_tables = _temp_table_ctes.get()
+        ctes = [
+            (cte, query) for cte in query._with_ctes
+            if cte not in statement_ctes and cte not in temp_tables
+        ]
+        return _generate_cte_sql(connection, query, as_sql, ctes)
+
+    ctes = [(cte, query) for cte in query._with_ctes]
+    hoisted = find_hoistable_ctes(query)
+    temp_tables = _temp_table_ctes.get()
+    token = _statement_ctes.set({cte for cte, owner in ctes + hoisted})
+    try:
+        try:
+            sql, params = _generate_cte_sql(connection, query, as_sql, [
+                item for item in ctes + hoisted if item[0] not in temp_tables
+            ])
+            ctes += hoisted
+        except _HoistError:
+            _statement_ctes.set({cte for cte, owner in ctes})
+            sql, params = _generate_cte_sql(connection, query, as_sql, [
+                item for item in ctes if item[0] not in temp_tables
+            ])
+    finally:
+        _statement_ctes.reset(token)
+    if ctes and not query.subquery:
+        comment = get_sql_comment([cte.name for cte, owner in ctes])
+        if comment:
+            sql = f"{comment} {sql}"
+    return sql, params
+
+
+class _HoistError(Exception):
+    pass
+
+
+def _generate_cte_sql(connection, query, as_sql, ctes):
+    if not ctes:
+        return as_sql()
+    if canonical_sql_enabled():
+        ctes = sorted(ctes, key=lambda item: item[0].name)
+
+    # CTEs of this WITH clause shadow outer CTEs having the same name
+    renames = {
+        name: other for name, other in cte_renames.get().items()
+        if not any(cte.name == name for cte, owner in ctes)
+    }
+    token = cte_renames.set(renames)
+    try:
+        return _compile_with_clause(connection, query, as_sql, ctes, renames)
+    finally:
+        cte_renames.reset(token)
+
+
+def _compile_with_clause(connection, query, as_sql, ctes, renames):
+    sqls = []
+    params = []
+    # raw SQL may reference any CTE by name, so none can be dropped
+    dedupe = all(isinstance(cte.query, Query) for cte, owner in ctes)
+    bodies = {}
+    auto = {}
+    compiled = []
+    instrument = cte_compiled.has_listeners()
+    for cte, owner in ctes:
+        if instrument:
+            start = perf_counter()
+        if owner is query:
+            alias = query.alias_map.get(cte.name)
+            should_elide_empty = (
+                    not isinstance(alias, QJoin) or alias.join_type != LOUTER
+            )
+        else:
+            # hoisted from a subquery, which may handle empty results
+            should_elide_empty = False
+
+        compiler = get_cte_compiler(cte, connection, should_elide_empty)
 
         qn = compiler.quote_name_unless_alias
         try:
             cte_sql, cte_params = compiler.as_sql()
         except EmptyResultSet:
+            if owner is not query:
+                raise _HoistError
             # If the CTE raises an EmptyResultSet the SqlCompiler still
             # needs to know the information about this base compiler
             # like, col_count and klass_info.
             as_sql()
             raise
-        template = get_cte_query_template(cte)
-        ctes.append(template.format(name=qn(cte.name), query=cte_sql))
-        params.extend(cte_params)
+        strategy = get_cte_strategy(cte)
+        template = _templates[strategy]
+        key = (strategy, fingerprint_sql(cte_sql, cte_params))
+        if dedupe and key in bodies:
+            # identical query: references are renamed to the first CTE
+            # having it when they are compiled
+            renames[cte.name] = bodies[key]
+        else:
+            bodies[key] = cte.name
+            if strategy == "auto":
+                auto[cte.name] = (len(sqls), qn(cte.name), cte_sql)
+            sqls.append(template.format(name=qn(cte.name), query=cte_sql))
+            params.extend(cte_params)
+        if instrument:
+            compiled.append((
+                cte, owner, strategy, perf_counter() - start,
+                len(cte_sql), len(cte_params),
+            ))
 
     explain_attribute = "explain_info"
     explain_info = getattr(query, explain_attribute, None)
@@ -115,24 +298,204 @@ def generate_cte_sql(connection, query, as_sql):
         # WITH ... clause and the final SELECT
         setattr(query, explain_attribute, None)
 
-    if ctes:
-        # Always use WITH RECURSIVE
-        # https://www.postgresql.org/message-id/13122.1339829536%40sss.pgh.pa.us
-        sql.extend(["WITH RECURSIVE", ", ".join(ctes)])
     base_sql, base_params = as_sql()
 
     if explain_query_or_info:
         setattr(query, explain_attribute, explain_query_or_info)
 
-    sql.append(base_sql)
     params.extend(base_params)
+    strategies = {}
+    if auto and _executing_query.get() is query:
+        # only when the outermost statement is executed: nested SQL may
+        # reference outer aliases, and str(query) must not query the db
+        strategies = _choose_strategies(
+            connection, sqls, auto, base_sql, tuple(params))
+    # Always use WITH RECURSIVE
+    # https://www.postgresql.org/message-id/13122.1339829536%40sss.pgh.pa.us
+    sql.extend(["WITH RECURSIVE", ", ".join(sqls), base_sql])
+    for cte, owner, strategy, duration, sql_length, param_count in compiled:
+        strategy = strategies.get(cte.name, strategy)
+        cte_compiled.send(
+            sender=type(cte),
+            cte=cte,
+            name=cte.name,
+            duration=duration,
+            sql_length=sql_length,
+            param_count=param_count,
+            materialized=strategy == "materialized",
+            hoisted=owner is not query,
+            connection=connection,
+        )
     return " ".join(sql), tuple(params)
 
 
+def _choose_strategies(connection, sqls, auto, base_sql, params):
+    """Choose strategies of "auto" CTEs and update their SQL in place"""
+    def make_sql(choices):
+        with_sqls = list(sqls)
+        for name, strategy in choices.items():
+            index, qname, cte_sql = auto[name]
+            with_sqls[index] = _templates[strategy].format(
+                name=qname, query=cte_sql)
+        return " ".join(["WITH RECURSIVE", ", ".join(with_sqls), base_sql])
+
+    # one decision per statement SQL: costs are estimated with the
+    # parameters of the first execution, later executions with other
+    # parameters reuse the decision until it expires
+    key = fingerprint_sql(make_sql({}), ())
+    strategies = choose_strategies(
+        connection, key, list(auto), make_sql, params)
+    for name, strategy in strategies.items():
+        index, qname, cte_sql = auto[name]
+        sqls[index] = _templates[strategy].format(name=qname, query=cte_sql)
+    return strategies
+
+
+def fingerprint_sql(sql, params):
+    """Get a structural fingerprint of SQL and its parameters
+
+    A leading SQL comment (see `get_sql_comment()`) is ignored.
+
+    :returns: A hex digest string.
+    """
+    sql = _leading_comment.sub("", sql)
+    data = repr((sql, tuple(params))).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def find_hoistable_ctes(query):
+    """Find CTEs of nested queries that can be moved to the WITH clause
+    of the given query
+
+    CTEs of a nested query are hoisted only if all of them can be
+    hoisted: each must not reference an outer query, and its name must
+    not be used by any other CTE anywhere in the statement.
+
+    :returns: A list of `(cte, owner_query)` pairs.
+    """
+    groups = []
+    names = {}
+    for cte in query._with_ctes:
+        names.setdefault(cte.name, set()).add(cte)
+    for node, depth in walk(query):
+        ctes = getattr(node, "_with_ctes", None)
+        if node is query or not ctes or not isinstance(node, Query):
+            continue
+        groups.append((node, ctes))
+        for cte in ctes:
+            names.setdefault(cte.name, set()).add(cte)
+
+    hoisted = []
+    seen = set(query._with_ctes)
+    for node, ctes in groups:
+        if all(
+            len(names[cte.name]) == 1
+            and cte.query is not None
+            and not cte._references_outer_query()
+            for cte in ctes
+        ):
+            for cte in ctes:
+                if cte not in seen:
+                    seen.add(cte)
+                    hoisted.append((cte, node))
+    return hoisted
+
+
+def get_cte_compiler(cte, connection, elide_empty=True):
+    if django.VERSION > (4, 2):
+        _ignore_with_col_aliases(cte.query)
+    query = cte.query
+    if canonical_sql_enabled() and isinstance(query, Query) and (
+        not isinstance(query, CTEQuery)
+    ):
+        query = canonicalize_aliases(query)
+    return query.get_compiler(
+        connection=connection, elide_empty=elide_empty
+    )
+
+
+def get_cte_strategy(cte):
+    if cte.strategy is None and cte.materialized:
+        return "materialized"
+    return cte.strategy
+
+
 def get_cte_query_template(cte):
-    if cte.materialized:
-        return "{name} AS MATERIALIZED ({query})"
-    return "{name} AS ({query})"
+    return _templates[get_cte_strategy(cte)]
+
+
+_templates = {
+    None: "{name} AS ({query})",
+    "materialized": "{name} AS MATERIALIZED ({query})",
+    "inline": "{name} AS NOT MATERIALIZED ({query})",
+    # chosen by estimated cost when the statement is compiled
+    "auto": "{name} AS ({query})",
+    # used when the statement is compiled without being executed
+    "temp_table": "{name} AS MATERIALIZED ({query})",
+}
+
+
+def get_temp_table_ctes(query):
+    """Get CTEs of a query to be created as temporary tables
+
+    Only CTEs of the outermost query (not hoisted from subqueries) are
+    created as temporary tables.
+
+    :returns: A list of CTEs in the order in which tables must be
+    created: each CTE comes after the CTEs it references.
+    """
+    by_name = {cte.name: cte for cte in query._with_ctes}
+    ordered = []
+
+    def add(cte, visiting=()):
+        if cte in ordered or cte in visiting:
+            return
+        for dep in _referenced_ctes(cte, by_name):
+            if get_cte_strategy(dep) == "temp_table":
+                add(dep, visiting + (cte,))
+        ordered.append(cte)
+
+    for cte in query._with_ctes:
+        if get_cte_strategy(cte) == "temp_table":
+            add(cte)
+    return ordered
+
+
+def get_temp_table_sql(connection, query, cte, created):
+    """Get SQL and params of the query to create a temporary table
+
+    :param query: The query to which the CTE belongs.
+    :param cte: The CTE to be created as a temporary table.
+    :param created: CTEs that already exist as temporary tables.
+    :returns: `(sql, params)` CTE query with a WITH clause of the CTEs
+    it references.
+    """
+    by_name = {other.name: other for other in query._with_ctes}
+    deps = [
+        (dep, None) for dep in _referenced_ctes(cte, by_name)
+        if dep not in created
+    ]
+    token = _statement_ctes.set(set(query._with_ctes))
+    try:
+        compiler = get_cte_compiler(cte, connection, elide_empty=False)
+        return _generate_cte_sql(connection, cte.query, compiler.as_sql, deps)
+    finally:
+        _statement_ctes.reset(token)
+
+
+def _referenced_ctes(cte, by_name):
+    """Get CTEs referenced (directly or indirectly) by a CTE's query"""
+    found = []
+    stack = [cte]
+    while stack:
+        for node, depth in walk(stack.pop().query):
+            for alias in getattr(node, "alias_map", {}).values():
+                other = by_name.get(alias.table_name)
+                if other is not None and other is not cte \
+                        and other not in found:
+                    found.append(other)
+                    stack.append(other)
+    return found
 
 
 def _ignore_with_col_aliases(cte_query):
@@ -142,6 +505,102 @@ def _ignore_with_col_aliases(cte_query):
         )
 
 
+def get_sql_comment(names):
+    """Get SQL comment tagging a statement with its CTE names and origin
+
+    Enabled with the `CTE_SQL_COMMENT` setting: `True` to include CTE
+    names and origin, or a sequence of the items to include ("ctes",
+    "origin"). The comment does not depend on parameter values, so it
+    does not fragment statement statistics such as pg_stat_statements.
+
+    :param names: Names of CTEs in the WITH clause of the statement.
+    :returns: SQL comment or `None` if disabled.
+    """
+    items = getattr(settings, "CTE_SQL_COMMENT", False)
+    if not items:
+        return None
+    if items is True:
+        items = ("ctes", "origin")
+    parts = []
+    for item in items:
+        if item == "ctes":
+            parts.append("ctes=" + ",".join(names))
+        elif item == "origin":
+            origin = get_origin()
+            if origin:
+                parts.append("origin=" + origin)
+        else:
+            raise ValueError(f"Unknown CTE_SQL_COMMENT item: {item!r}")
+    # "*/" would end the comment; "%" is a placeholder escape character
+    text = "; ".join(parts).replace("*/", "* /").replace("%", "%%")
+    return f"/* {text} */"
+
+
+def get_origin():
+    """Get qualified name of the function that is executing a query
+
+    :returns: The name of the innermost function on the call stack that
+    is not part of Django or django-cte, or `None`.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not _is_internal_module(module):
+            code = frame.f_code
+            return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+        frame = frame.f_back
+    return None
+
+
+def _is_internal_module(module):
+    package = module.partition(".")[0]
+    return package in _internal_packages
+
+
+_internal_packages = {"django", "django_cte", "asgiref", "contextlib"}
+_leading_comment = re.compile(r"^/\*.*?\*/ ", re.S)
+
+
+def canonical_sql_enabled():
+    return getattr(settings, "CTE_CANONICAL_SQL", False)
+
+
+def canonicalize_aliases(query):
+    """Get a clone of a query with table aliases renumbered
+
+    Django numbers join aliases (T2, T3, ...) as joins are added while
+    a query is constructed, and joins that are later trimmed leave gaps
+    in the numbering. Aliases of joins used by the clone are numbered
+    by position, as if the query had been constructed without the
+    unused joins. Aliases of subqueries are numbered by position when
+    they are resolved, and are not changed.
+
+    :param query: A `Query`, which is not modified.
+    :returns: A `Query`.
+    """
+    used = [
+        (alias, join) for alias, join in query.alias_map.items()
+        if query.alias_refcount[alias]
+    ]
+    change_map = {}
+    for position, (alias, join) in enumerate(used, start=1):
+        if alias != join.table_name:
+            new_alias = f"{query.alias_prefix}{position}"
+            if new_alias != alias:
+                change_map[alias] = new_alias
+    clone = query.clone()
+    if change_map.keys() & set(change_map.values()):
+        # aliases must be changed in two steps to swap names
+        temporary = {
+            alias: f"__cte_alias_{i}" for i, alias in enumerate(change_map)
+        }
+        clone.change_aliases(temporary)
+        change_map = {temporary[old]: new for old, new in change_map.items()}
+    if change_map:
+        clone.change_aliases(change_map)
+    return clone
+
+
 class CTECompiler(JITMixin):
     """Mixin for django.db.models.sql.compiler.SQLCompiler"""
     _jit_mixin_prefix = "CTE"
@@ -149,7 +608,78 @@ class CTECompiler(JITMixin):
     def as_sql(self, *args, **kwargs):
         def _as_sql():
             return super(CTECompiler, self).as_sql(*args, **kwargs)
-        return generate_cte_sql(self.connection, self.query, _as_sql)
+        instrument = (
+            not self.query.subquery and cte_query_compiled.has_listeners()
+        )
+        if instrument:
+            start = perf_counter()
+        result = generate_cte_sql(self.connection, self.query, _as_sql)
+        is_sql = isinstance(result, tuple) and isinstance(result[0], str)
+        if instrument and is_sql:
+            sql, params = result
+            cte_query_compiled.send(
+                sender=self.query.model,
+                query=self.query,
+                duration=perf_counter() - start,
+                sql_length=len(sql),
+                param_count=len(params),
+                cte_count=len(self.query._with_ctes),
+                connection=self.connection,
+            )
+        return result
+
+    def execute_sql(self, result_type=MULTI, *args, **kwargs):
+        if self.query.subquery:
+            return super().execute_sql(result_type, *args, **kwargs)
+        token = _executing_query.set(self.query)
+        try:
+            return self._execute_statement(result_type, *args, **kwargs)
+        finally:
+            _executing_query.reset(token)
+
+    def _execute_statement(self, result_type, *args, **kwargs):
+        connection = self.connection
+        reused = get_reused_ctes(connection.alias)
+        if reused:
+            statement = list(self.query._with_ctes)
+            statement.extend(
+                cte for cte, owner in find_hoistable_ctes(self.query))
+            reused = {cte: reused[cte] for cte in statement if cte in reused}
+        temp_tables = [
+            cte for cte in self.query._with_ctes
+            if get_cte_strategy(cte) == "temp_table" and cte not in reused
+        ]
+        if not temp_tables and not reused:
+            return super().execute_sql(result_type, *args, **kwargs)
+        if temp_tables and result_type == MULTI:
+            # rows must be fetched before temporary tables are dropped
+            if args:
+                args = (False, *args[1:])
+            else:
+                kwargs["chunked_fetch"] = False
+        new = [cte for cte, scope in reused.items() if cte not in scope.created]
+        with transaction.atomic(using=connection.alias):
+            created = [cte for cte in reused if cte not in new]
+            temp_tables = [
+                cte for cte in get_temp_table_ctes(self.query)
+                if cte not in reused
+            ]
+            for cte in new + temp_tables:
+                sql, params = get_temp_table_sql(
+                    connection, self.query, cte, created)
+                create_temp_table(
+                    connection, cte.name, sql, params, cte.indexes)
+                created.append(cte)
+            token = _temp_table_ctes.set(frozenset(created))
+            try:
+                result = super().execute_sql(result_type, *args, **kwargs)
+            finally:
+                _temp_table_ctes.reset(token)
+            for cte in reversed(temp_tables):
+                drop_temp_table(connection, cte.name)
+        for cte in new:
+            reused[cte].created.append(cte)
+        return result
 
 
 class NoAliasQuery(JITMixin):
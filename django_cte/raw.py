@@ -1,9 +1,16 @@
-def raw_cte_sql(sql, params, refs):
+def raw_cte_sql(sql, params, refs, reads=None, writes=None):
     """Raw CTE SQL
 
     :param sql: SQL query (string).
     :param params: List of bind parameters.
     :param refs: Dict of output fields: `{"name": <Field instance>}`.
+    :param reads: Optional sequence of names of tables read by the
+    query. Table dependencies of queries using the CTE are unknown if
+    this is not declared.
+    :param writes: Optional sequence of names of tables modified by the
+    query (for data-modifying statements such as DELETE ... RETURNING).
+    Pass an empty sequence to declare a read-only query. Queries using
+    the CTE are not routed to read replicas if this is not declared.
     :returns: Object that can be passed to `With`.
     """
 
@@ -28,6 +35,8 @@ def raw_cte_sql(sql, params, refs):
     class raw_cte_queryset:
         class query:
             annotations = {}
+            tables_read = None if reads is None else frozenset(reads)
+            tables_written = None if writes is None else frozenset(writes)
 
             @staticmethod
             def get_compiler(connection, *, elide_empty=None):
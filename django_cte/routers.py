@@ -0,0 +1,132 @@
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.sql import Query
+
+from .query import walk
+from .tables import get_dependencies
+
+
+class CTEReplicaRouter:
+    """Database router sending read-only CTE queries to read replicas
+
+    Querysets constructed with `with_cte()` are routed to a replica
+    unless one of their CTEs modifies data, in which case they are
+    routed to the primary database. Data-modifying CTEs are detected
+    by walking the query passed to `with_cte()`, including CTEs of its
+    subqueries and CTEs referenced by other CTEs, and the `writes`
+    declared for raw CTEs. Raw CTEs with undeclared dependencies are
+    assumed to modify data. Reads without CTEs are left to other
+    routers. All writes are routed to the primary
+    database, and relations are allowed between objects of the primary
+    and replica databases.
+
+    Settings:
+
+    - `CTE_READ_REPLICAS`: list of replica database aliases.
+    - `CTE_PRIMARY_DATABASE`: primary database alias. Defaults to
+      `"default"`.
+    """
+
+    @property
+    def replicas(self):
+        return list(getattr(settings, "CTE_READ_REPLICAS", ()))
+
+    @property
+    def primary(self):
+        return getattr(settings, "CTE_PRIMARY_DATABASE", DEFAULT_DB_ALIAS)
+
+    def db_for_read(self, model, **hints):
+        query = hints.get("cte_query")
+        if query is not None:
+            tables = get_query_tables_read(query)
+        elif hints.get("ctes"):
+            tables = get_cte_tables_read(hints["ctes"])
+        else:
+            return None
+        if tables is None:
+            return self.primary
+        return self.choose_replica(model, tables)
+
+    def db_for_write(self, model, **hints):
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {self.primary, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def choose_replica(self, model, tables):
+        """Choose replica for a read-only CTE query
+
+        Override to route by model or tables, for example to avoid
+        replicas that lag behind the primary for some tables.
+
+        :param model: Model of the queryset.
+        :param tables: Set of table names read by the query.
+        :returns: Database alias or `None` to fall back to other routers.
+        """
+        replicas = self.replicas
+        return random.choice(replicas) if replicas else None
+
+
+def get_query_tables_read(query):
+    """Get tables read by a read-only query
+
+    :param query: A query, normally of a queryset constructed with
+    `with_cte()`.
+    :returns: A set of table names, or `None` if any CTE modifies data
+    or has undeclared dependencies.
+    """
+    try:
+        deps = get_dependencies(query)
+    except ValueError:
+        return None
+    if deps.written or any(
+        cte.query.tables_written is None for cte in _get_raw_ctes(query)
+    ):
+        return None
+    return set(deps.read)
+
+
+def get_cte_tables_read(ctes):
+    """Get tables read by read-only CTEs
+
+    :param ctes: A sequence of CTE objects.
+    :returns: A set of table names, or `None` if any CTE modifies data
+    or has undeclared dependencies.
+    """
+    read = set()
+    for cte in ctes:
+        try:
+            deps = get_dependencies(cte)
+        except ValueError:
+            return None
+        if deps.written or any(
+            c.query.tables_written is None for c in _get_raw_ctes(cte)
+        ):
+            return None
+        read.update(deps.read)
+    return read
+
+
+def _get_raw_ctes(obj, seen=None):
+    """Iterate over raw CTEs of a query or CTE, including CTEs of nested
+    queries and CTEs referenced by name
+    """
+    query = getattr(obj, "query", obj)
+    if not isinstance(query, Query):
+        yield obj
+        return
+    if seen is None:
+        seen = set()
+    for node, depth in walk(query):
+        for cte in getattr(node, "_with_ctes", ()):
+            if not isinstance(cte.query, Query):
+                yield cte
+        for cte in getattr(node, "_cte_refs", {}).values():
+            if cte is not None and cte not in seen:
+                seen.add(cte)
+                yield from _get_raw_ctes(cte, seen)
@@ -0,0 +1,204 @@
+import heapq
+from functools import cmp_to_key
+from itertools import islice
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import F, OrderBy
+from django.db.models.query import (
+    FlatValuesListIterable,
+    NamedValuesListIterable,
+    ValuesIterable,
+    ValuesListIterable,
+)
+
+from .parallel import COMBINE, execute_all, reaggregate
+
+
+def execute_sharded(
+    queryset,
+    aliases,
+    executor=None,
+    max_workers=None,
+    aggregates=None,
+):
+    """Execute a queryset on many databases and merge the results
+
+    The queryset is executed concurrently on each database, each on its
+    own connection. Results are merged in the order of the queryset's
+    `order_by()` (or the default ordering of its model), and sliced as
+    the queryset is sliced. Each database returns at most the number of
+    rows needed for the slice. Results of unordered querysets are
+    concatenated in the order of `aliases`.
+
+    Ordering must be by fields or annotations present in the results,
+    given as names (optionally prefixed with "-"), `F()` expressions,
+    or `F().asc()`/`F().desc()` (with optional `nulls_first` or
+    `nulls_last`). Rows are compared in Python, with NULL sorted as on
+    the first database. Text is compared by code point, which matches
+    binary collations (SQLite's default, "C" on PostgreSQL) but not
+    linguistic ones: with those, the merged order (and slice) of text
+    columns may differ from the order of a single database.
+
+    :param queryset: A queryset, normally constructed with `with_cte()`.
+    :param aliases: A sequence of database aliases.
+    :param executor: Optional `concurrent.futures.Executor` used to
+    execute the queryset on each database. A `ThreadPoolExecutor` with
+    `max_workers` threads is used by default.
+    :param max_workers: Number of threads of the default executor.
+    Defaults to the number of databases.
+    :param aggregates: Optional dict of aggregate functions ("sum",
+    "count", "min" or "max") by column name, used to combine the rows
+    of all databases (which must be dicts, as returned by `values()`)
+    with equal values in all other columns. Combined rows are sorted
+    and sliced after they are combined.
+    :returns: A list of results in the format of the queryset.
+    :raises ValueError: if the ordering cannot be evaluated on the
+    results.
+    """
+    if aggregates:
+        unknown = set(aggregates.values()) - COMBINE.keys()
+        if unknown:
+            raise ValueError(f"Unknown aggregate functions: {sorted(unknown)}")
+    query = queryset.query
+    low, high = query.low_mark, query.high_mark
+    key = _get_order_key(queryset, connections[aliases[0]]) if aliases else None
+    shard_querysets = []
+    for alias in aliases:
+        shard = queryset.all().using(alias)
+        shard.query.clear_limits()
+        if high is not None and not aggregates:
+            shard.query.set_limits(high=high)
+        shard_querysets.append(shard)
+    results = execute_all(shard_querysets, executor, max_workers)
+    if aggregates:
+        rows = reaggregate((row for rows in results for row in rows), aggregates)
+        if key is not None:
+            rows.sort(key=key)
+    elif key is not None:
+        rows = heapq.merge(*results, key=key)
+    else:
+        rows = (row for rows in results for row in rows)
+    return list(islice(rows, low, high))
+
+
+def _get_order_key(queryset, connection):
+    query = queryset.query
+    if query.order_by:
+        ordering = query.order_by
+    elif query.default_ordering and query.get_meta().ordering:
+        ordering = query.get_meta().ordering
+    else:
+        return None
+    if not query.standard_ordering:
+        ordering = [_reverse(item) for item in ordering]
+    nulls_largest = connection.features.nulls_order_largest
+    columns = [
+        _get_column_getter(queryset, item, nulls_largest) for item in ordering
+    ]
+
+    def compare(row1, row2):
+        for get_value, descending, nulls_first in columns:
+            value1 = get_value(row1)
+            value2 = get_value(row2)
+            if value1 is None or value2 is None:
+                if value1 is value2:
+                    continue
+                return -1 if (value1 is None) == nulls_first else 1
+            if value1 != value2:
+                result = -1 if value1 < value2 else 1
+                return -result if descending else result
+        return 0
+
+    return cmp_to_key(compare)
+
+
+def _reverse(item):
+    if isinstance(item, str):
+        return item[1:] if item.startswith("-") else f"-{item}"
+    if isinstance(item, OrderBy):
+        item = item.copy()
+        item.reverse_ordering()
+        return item
+    return OrderBy(item, descending=True)
+
+
+def _get_column_getter(queryset, item, nulls_largest):
+    """Get a function getting the value of an ordering item from a row
+
+    :returns: `(get_value, descending, nulls_first)`
+    :raises ValueError: if the ordering item is not a column of the
+    results.
+    """
+    descending = False
+    nulls_first = None
+    if isinstance(item, OrderBy):
+        descending = item.descending
+        if item.nulls_first or item.nulls_last:
+            nulls_first = bool(item.nulls_first)
+        item = item.expression
+    if isinstance(item, F):
+        item = item.name
+    if not isinstance(item, str) or item == "?" or "__" in item:
+        raise ValueError(f"Cannot merge results ordered by {item!r}")
+    if item.startswith("-"):
+        descending = not descending
+        item = item[1:]
+    if nulls_first is None:
+        # database default: NULL sorts as the largest or smallest value
+        nulls_first = descending if nulls_largest else not descending
+    query = queryset.query
+    meta = queryset.model._meta
+    name = meta.pk.name if item == "pk" else item
+    try:
+        attname = meta.get_field(name).attname
+    except FieldDoesNotExist:
+        attname = name
+
+    iterable = queryset._iterable_class
+    if issubclass(iterable, (ValuesIterable, *_values_list_iterables)):
+        # columns in the order of Django's values iterables
+        names = [
+            *query.extra_select,
+            *query.values_select,
+            *query.annotation_select,
+        ]
+        if queryset._fields and not issubclass(iterable, ValuesIterable):
+            names = [*queryset._fields, *(
+                n for n in query.annotation_select
+                if n not in queryset._fields
+            )]
+    else:
+        names = [
+            *(f.attname for f in meta.concrete_fields),
+            *query.annotation_select,
+        ]
+    selected = next((n for n in (name, attname) if n in names), None)
+    if selected is None:
+        raise ValueError(
+            f"Cannot merge results ordered by {item!r}, "
+            f"which is not selected. Selected: {names}"
+        )
+
+    if issubclass(iterable, ValuesIterable):
+        def get_value(row):
+            return row[selected]
+    elif issubclass(iterable, FlatValuesListIterable):
+        def get_value(row):
+            return row
+    elif issubclass(iterable, _values_list_iterables):
+        position = names.index(selected)
+
+        def get_value(row):
+            return row[position]
+    else:
+        def get_value(row):
+            return getattr(row, selected)
+    return get_value, descending, nulls_first
+
+
+_values_list_iterables = (
+    ValuesListIterable,
+    NamedValuesListIterable,
+    FlatValuesListIterable,
+)
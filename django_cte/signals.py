@@ -0,0 +1,27 @@
+from django.dispatch import Signal
+
+# Sent after each CTE of a statement is compiled to SQL.
+#
+# sender: the CTE class.
+# cte: the CTE.
+# name: the CTE name.
+# duration: compile time in seconds.
+# sql_length: length of the compiled CTE query SQL.
+# param_count: number of bind parameters of the CTE query.
+# materialized: `True` if the CTE is materialized.
+# hoisted: `True` if the CTE was hoisted from a subquery.
+# connection: the database connection.
+cte_compiled = Signal()
+
+# Sent after a statement with CTEs is compiled to SQL. Not sent for
+# subqueries, which are included in the statement that contains them.
+#
+# sender: the model class of the query.
+# query: the query.
+# duration: compile time in seconds, including the time to compile CTEs.
+# sql_length: length of the compiled SQL.
+# param_count: number of bind parameters.
+# cte_count: number of CTEs of the query, not including CTEs hoisted
+# from subqueries.
+# connection: the database connection.
+cte_query_compiled = Signal()
@@ -0,0 +1,67 @@
+import json
+from time import monotonic
+
+from django.conf import settings
+
+STRATEGIES = (None, "materialized", "inline", "auto", "temp_table")
+
+_decisions = {}
+_MAX_DECISIONS = 10000
+
+
+def choose_strategies(connection, key, names, make_sql, params):
+    """Choose strategies of "auto" CTEs by comparing estimated costs
+
+    The cost of each candidate statement is estimated with `EXPLAIN`
+    (without `ANALYZE`, the statement is not executed). CTEs are
+    inlined unless materializing them lowers the estimated cost.
+    Decisions are cached per statement key for `CTE_STRATEGY_CACHE_TTL`
+    seconds (default: 300). Strategies can only be chosen on
+    PostgreSQL; other databases decide themselves how to evaluate CTEs.
+
+    :param connection: Database connection.
+    :param key: Cache key of the statement. Costs are estimated with
+    `params`, and the decision is reused for other parameters having
+    the same key.
+    :param names: Names of CTEs with "auto" strategy.
+    :param make_sql: Function taking a dict of CTE names to strategies
+    and returning statement SQL.
+    :param params: Statement parameters.
+    :returns: A dict of CTE names to "materialized", "inline" or `None`.
+    """
+    if connection.vendor != "postgresql":
+        return dict.fromkeys(names)
+    key = (connection.alias, key)
+    now = monotonic()
+    cached = _decisions.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    choices = dict.fromkeys(names, "inline")
+    best = estimate_cost(connection, make_sql(choices), params)
+    for name in names:
+        trial = {**choices, name: "materialized"}
+        cost = estimate_cost(connection, make_sql(trial), params)
+        if cost < best:
+            choices, best = trial, cost
+
+    if len(_decisions) >= _MAX_DECISIONS:
+        _decisions.clear()
+    ttl = getattr(settings, "CTE_STRATEGY_CACHE_TTL", 300)
+    _decisions[key] = (now + ttl, choices)
+    return choices
+
+
+def estimate_cost(connection, sql, params):
+    """Get estimated total cost of a statement from the query planner"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]["Total Cost"]
+
+
+def clear_cache():
+    """Forget cached strategy decisions"""
+    _decisions.clear()
@@ -0,0 +1,115 @@
+import sys
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db import connections, transaction
+
+from .query import get_temp_table_ctes
+from .temptable import _Scope, get_reused_ctes
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def stream(queryset, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Iterate over the results of a queryset without loading them all
+    into memory
+
+    Rows are fetched from the database `chunk_size` at a time using a
+    server-side cursor on backends that support them (PostgreSQL,
+    unless `DISABLE_SERVER_SIDE_CURSORS` is set) and `fetchmany()` on
+    others. The cursor is opened in a transaction, which is committed
+    when the iterator is exhausted or closed, so that rows are streamed
+    as they are produced instead of being materialized by the database
+    server for a cursor `WITH HOLD`. No transaction management may
+    happen on the connection until the iterator is exhausted or closed.
+    An iterator that is garbage collected before it is exhausted is
+    closed. Temporary tables of CTEs with the `"temp_table"` strategy
+    are kept for the lifetime of the iterator.
+
+    :param queryset: A queryset, normally constructed with `with_cte()`.
+    :param chunk_size: Number of rows fetched per round trip.
+    :param progress: Optional callable `progress(count)` called with
+    the number of rows produced so far after each chunk and when the
+    iterator is exhausted.
+    :returns: An iterator of results in the format of the queryset.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+    using = queryset.db
+    reused = get_reused_ctes(using)
+    temp_tables = [
+        cte for cte in get_temp_table_ctes(queryset.query)
+        if cte not in reused
+    ] if hasattr(queryset.query, "_with_ctes") else []
+    return _stream(queryset, using, chunk_size, progress, temp_tables)
+
+
+async def astream(queryset, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Async version of `stream()`
+
+    Rows are fetched in a thread one chunk at a time (one thread switch
+    per chunk, not per row). The `progress` callable is called in that
+    thread. The transaction of the cursor is open on the database
+    connection of that thread until the iterator is exhausted or closed.
+
+    :returns: An async iterator of results in the format of the queryset.
+    """
+    items = stream(queryset, chunk_size, progress)
+    next_chunk = sync_to_async(lambda: list(islice(items, chunk_size)))
+    try:
+        while True:
+            chunk = await next_chunk()
+            for item in chunk:
+                yield item
+            if len(chunk) < chunk_size:
+                break
+    finally:
+        await sync_to_async(items.close)()
+
+
+def _stream(queryset, using, chunk_size, progress, temp_tables):
+    # The transaction of the cursor stays open between items, so no
+    # transaction management may happen on the connection until the
+    # iterator is exhausted or closed. Temporary tables are reused only
+    # while the query is executed (on the first item), so the context
+    # variables of the caller are not changed between items.
+    connection = connections[using]
+    scope = _Scope(temp_tables, using)
+    atomic = transaction.atomic(using=using)
+    atomic.__enter__()
+    items = queryset.iterator(chunk_size)
+    count = 0
+    failed = False
+    try:
+        with scope.active():
+            item = next(items, _END)
+        while item is not _END:
+            count += 1
+            yield item
+            if progress is not None and count % chunk_size == 0:
+                progress(count)
+            item = next(items, _END)
+        if progress is not None and (not count or count % chunk_size):
+            progress(count)
+    except GeneratorExit:
+        # closed or garbage collected before exhausted: commit instead
+        # of rolling back the transaction, which may contain
+        # data-modifying CTEs
+        pass
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        try:
+            items.close()
+            if not failed:
+                # tables are dropped on rollback
+                scope.drop(connection)
+        finally:
+            if failed:
+                atomic.__exit__(*sys.exc_info())
+            else:
+                atomic.__exit__(None, None, None)
+
+
+_END = object()
@@ -0,0 +1,134 @@
+from collections import namedtuple
+from itertools import chain
+
+from django.db.models.expressions import RawSQL
+from django.db.models.sql import Query
+from django.db.models.sql.subqueries import (
+    DeleteQuery,
+    InsertQuery,
+    UpdateQuery,
+)
+from django.db.models.sql.where import ExtraWhere
+
+from .cte import CTE
+from .query import _walk_expression, walk
+
+class TableDependencies(namedtuple("TableDependencies", "read written")):
+    """Names of tables read and written by a query
+
+    :param read: Frozen set of names of tables read by the query.
+    :param written: Frozen set of names of tables modified by the query.
+    """
+    __slots__ = ()
+
+
+def get_dependencies(obj):
+    """Get tables read and written by a queryset, query or CTE
+
+    Tables referenced by CTE queries (including CTEs of nested queries),
+    combined queries (union, etc.) and subqueries (in filters, join
+    conditions, annotations, select, group by and order by) are
+    included. CTE names are not; CTEs referenced by name (with
+    `cte.queryset()` or `cte.join()`) are resolved to the tables they
+    read, also when they are not attached to the query. Tables of raw
+    CTEs are included if they were declared with the `reads` and
+    `writes` parameters of `raw_cte_sql()`. Tables referenced by other
+    raw SQL (`RawSQL`, `extra(select=...)` or `extra(where=...)`)
+    cannot be known.
+
+    :param obj: A queryset, query or CTE. Pass an `UpdateQuery`,
+    `DeleteQuery` or `InsertQuery` to get tables written by it.
+    :returns: `TableDependencies(read, written)`.
+    :raises ValueError: if the query has a raw CTE with undeclared
+    dependencies or other raw SQL.
+    """
+    return _get_dependencies(obj, set())
+
+
+def _get_dependencies(obj, seen):
+    query = getattr(obj, "query", obj)
+    if not isinstance(query, Query):
+        return _get_raw_dependencies(obj)
+    read = set()
+    written = set()
+    # names of CTEs, which are not tables
+    cte_names = {obj.name} if isinstance(obj, CTE) else set()
+    referenced = {}
+    nodes = walk(query)
+    if isinstance(query, UpdateQuery):
+        nodes = chain(nodes, *(
+            _walk_expression(value, 0)
+            for field, model, value in query.values
+            if hasattr(value, "resolve_expression")
+        ))
+    for node, depth in nodes:
+        ctes = getattr(node, "_with_ctes", ())
+        cte_names.update(cte.name for cte in ctes)
+        for cte in ctes:
+            if not isinstance(cte.query, Query):
+                raw_read, raw_written = _get_raw_dependencies(cte)
+                read.update(raw_read)
+                written.update(raw_written)
+        if isinstance(node, (RawSQL, ExtraWhere)):
+            sql = node.sql if isinstance(node, RawSQL) else " AND ".join(
+                node.sqls)
+            raise ValueError(
+                f"Unknown table dependencies of raw SQL: {sql!r}")
+        if isinstance(node, Query):
+            if node.extra:
+                raise ValueError(
+                    "Unknown table dependencies of extra(select=...): "
+                    f"{list(node.extra)}"
+                )
+            read.update(
+                table.table_name
+                for alias, table in node.alias_map.items()
+                # joins trimmed from the query are not referenced
+                if node.alias_refcount.get(alias) or table.join_type is None
+            )
+            if not node.alias_map and node.model is not None:
+                # base table is joined when the query is compiled
+                read.add(node.get_meta().db_table)
+            read.update(node.extra_tables)
+            referenced.update(getattr(node, "_cte_refs", {}))
+    # CTEs referenced by queries but defined elsewhere (e.g., the body of
+    # CTE(a.queryset()) references "a"): include the tables they read
+    for name, cte in referenced.items():
+        # None: recursive reference to a CTE being defined
+        known = cte is None or name in cte_names or cte in seen
+        cte_names.add(name)
+        if known:
+            continue
+        seen.add(cte)
+        cte_read, cte_written = _get_dependencies(cte, seen)
+        read.update(cte_read)
+        written.update(cte_written)
+    if isinstance(query, (UpdateQuery, DeleteQuery, InsertQuery)):
+        written.add(query.get_meta().db_table)
+        for model in getattr(query, "related_updates", {}):
+            written.add(model._meta.db_table)
+    return TableDependencies(
+        frozenset(read - cte_names),
+        frozenset(written - cte_names),
+    )
+
+
+def _get_raw_dependencies(cte):
+    read = getattr(cte.query, "tables_read", None)
+    if read is None:
+        raise ValueError(
+            f"Unknown table dependencies of raw CTE {cte.name!r}. "
+            "Use raw_cte_sql(..., reads=[...]) to declare them."
+        )
+    return TableDependencies(read, cte.query.tables_written or frozenset())
+
+
+def get_tables(query):
+    """Get names of all tables read or written by a query
+
+    :returns: A frozen set of table names.
+    :raises ValueError: if the query has a raw CTE with undeclared
+    dependencies or other raw SQL.
+    """
+    read, written = get_dependencies(query)
+    return read | written
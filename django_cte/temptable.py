@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import truncate_name
+
+
+def create_temp_table(connection, name, sql, params, indexes=()):
+    """Create a temporary table from a query, index and analyze it
+
+    :param connection: Database connection.
+    :param name: Table name.
+    :param sql: SQL query producing the rows of the table.
+    :param params: Query parameters.
+    :param indexes: Sequence of column name tuples to index.
+    """
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TEMPORARY TABLE {qn(name)} AS {sql}", params)
+        for columns in indexes:
+            index_name = truncate_name(
+                "_".join([name, *columns, "idx"]),
+                connection.ops.max_name_length(),
+            )
+            cols = ", ".join(qn(c) for c in columns)
+            cursor.execute(
+                f"CREATE INDEX {qn(index_name)} ON {qn(name)} ({cols})")
+        cursor.execute(f"ANALYZE {qn(name)}")
+
+
+def drop_temp_table(connection, name, if_exists=False):
+    """Drop a temporary table"""
+    exists = " IF EXISTS" if if_exists else ""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE{exists} {connection.ops.quote_name(name)}")
+
+
+@contextmanager
+def reuse_ctes(*ctes, using=DEFAULT_DB_ALIAS):
+    """Reuse results of CTEs in queries executed within this context
+
+    Each CTE is written into a temporary table when the first query
+    that references it is executed. Later queries referencing the same
+    CTE object read the table instead of evaluating the CTE query
+    again. Tables are dropped on exit.
+
+    Temporary tables are dropped by the database if the transaction in
+    which they were created is rolled back, so the context should not
+    span a transaction that may be rolled back while it is active.
+
+    :param *ctes: CTE objects to reuse.
+    :param using: Database alias of queries reusing the CTEs.
+    """
+    scope = _Scope(ctes, using)
+    try:
+        with scope.active():
+            yield
+    finally:
+        scope.drop()
+
+
+def get_reused_ctes(using):
+    """Get CTEs reused in the current context on a database
+
+    :returns: A dict `{cte: scope}`. `scope.created` is a list of CTEs
+    for which temporary tables have been created.
+    """
+    return {
+        cte: scope
+        for scope in _scopes.get() if scope.using == using
+        for cte in scope.ctes
+    }
+
+
+class _Scope:
+
+    def __init__(self, ctes, using):
+        names = [cte.name for cte in ctes]
+        if len(set(names)) != len(names):
+            raise ValueError(f"CTE names must be unique: {names}")
+        self.ctes = ctes
+        self.using = using
+        self.created = []
+
+    @contextmanager
+    def active(self):
+        """Reuse the CTEs of this scope within this context"""
+        token = _scopes.set(_scopes.get() + (self,))
+        try:
+            yield
+        finally:
+            _scopes.reset(token)
+
+    def drop(self, connection=None):
+        """Drop temporary tables created in this scope"""
+        if connection is None:
+            connection = connections[self.using]
+        for cte in reversed(self.created):
+            drop_temp_table(connection, cte.name, if_exists=True)
+        self.created = []
+
+
+_scopes = ContextVar("django_cte_reuse_scopes", default=())
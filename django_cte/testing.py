@@ -0,0 +1,135 @@
+import difflib
+import json
+import os
+import re
+
+from django.db import connections
+
+from .explain import _sqlite_plan
+from .query import canonicalize_aliases
+
+UPDATE_ENV_VAR = "CTE_UPDATE_PLAN_SNAPSHOTS"
+
+
+def assert_plan_snapshot(queryset, name, directory, update=None):
+    """Assert that the plan shape of a queryset matches its snapshot
+
+    The snapshot is recorded if it does not exist.
+
+    :param queryset: A queryset, normally constructed with `with_cte()`.
+    :param name: Snapshot name. The snapshot file is named
+    `<name>.<vendor>.json`.
+    :param directory: Directory of snapshot files.
+    :param update: Record a new snapshot over an existing one. Defaults
+    to true if the `CTE_UPDATE_PLAN_SNAPSHOTS` environment variable is
+    set to a non-empty value.
+    :raises AssertionError: if the plan shape differs from the snapshot.
+    """
+    if update is None:
+        update = bool(os.environ.get(UPDATE_ENV_VAR))
+    vendor = connections[queryset.db].vendor
+    path = os.path.join(directory, f"{name}.{vendor}.json")
+    snapshot = get_snapshot(queryset)
+    if not update and os.path.exists(path):
+        with open(path, encoding="utf-8") as fh:
+            expected = json.load(fh)
+        if expected["plan"] != snapshot["plan"]:
+            diff = "\n".join(difflib.unified_diff(
+                expected["plan"],
+                snapshot["plan"],
+                "snapshot",
+                "current",
+                lineterm="",
+            ))
+            sql = ""
+            if expected["sql"] != snapshot["sql"]:
+                sql = (
+                    f"\n\nSnapshot SQL:\n{expected['sql']}"
+                    f"\n\nCurrent SQL:\n{snapshot['sql']}"
+                )
+            raise AssertionError(
+                f"Query plan of {name!r} differs from snapshot {path}\n\n"
+                f"{diff}{sql}\n\n"
+                f"Set {UPDATE_ENV_VAR}=1 to record a new snapshot."
+            )
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(snapshot, fh, indent=2)
+        fh.write("\n")
+
+
+def get_snapshot(queryset):
+    """Get compiled SQL and normalized plan shape of a queryset
+
+    :returns: A dict with keys "sql", "params" and "plan".
+    """
+    connection = connections[queryset.db]
+    query = canonicalize_aliases(queryset.query)
+    sql, params = query.get_compiler(connection=connection).as_sql()
+    return {
+        "sql": sql,
+        "params": [repr(p) for p in params],
+        "plan": plan_shape(queryset),
+    }
+
+
+def plan_shape(queryset):
+    """Get normalized shape of the query plan of a queryset
+
+    :returns: A list of plan node descriptions, indented by depth.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == "postgresql":
+        plan = json.loads(queryset.explain(format="json"))
+        lines = []
+        for item in plan:
+            _postgres_shape(item["Plan"], 0, lines)
+        return lines
+    if vendor == "sqlite":
+        lines = []
+        for node in _sqlite_plan(queryset.explain())["children"]:
+            _sqlite_shape(node, 0, lines)
+        # SQLite names table aliases in plan details
+        return _canonicalize_plan_aliases("\n".join(lines)).split("\n")
+    raise ValueError(f"Plan snapshots are not supported on {vendor}")
+
+
+def _postgres_shape(node, depth, lines):
+    desc = node["Node Type"]
+    if "Join Type" in node:
+        desc = f"{node['Join Type']} {desc}"
+    if "Index Name" in node:
+        desc += f" using {node['Index Name']}"
+    if "Relation Name" in node:
+        desc += f" on {node['Relation Name']}"
+    elif "CTE Name" in node:
+        desc += f" on {node['CTE Name']}"
+    if node.get("Parent Relationship") in ("InitPlan", "SubPlan"):
+        desc = f"{node.get('Subplan Name', node['Parent Relationship'])}: {desc}"
+    lines.append("  " * depth + desc)
+    for child in node.get("Plans", ()):
+        _postgres_shape(child, depth + 1, lines)
+
+
+def _sqlite_shape(node, depth, lines):
+    lines.append("  " * depth + node["detail"])
+    for child in node["children"]:
+        _sqlite_shape(child, depth + 1, lines)
+
+
+def _canonicalize_plan_aliases(text):
+    # renumber table aliases (T2, U0, ...) named in SQLite plan details,
+    # which depend on how the query was constructed
+    aliases = {}
+
+    def rename(match):
+        alias = match.group(0)
+        if alias not in aliases:
+            aliases[alias] = f"T{len(aliases) + 1}"
+        return aliases[alias]
+
+    return _plan_alias.sub(rename, text)
+
+
+_plan_alias = re.compile(r"\b[A-Z]\d+\b")
@@ -9,7 +9,12 @@ from unmagic import fixture
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
 django.setup()
 
+from django.db.models.aggregates import Sum  # noqa
+
+from django_cte import CTE, with_cte  # noqa
+
 from .django_setup import init_db, destroy_db  # noqa
+from .models import Order, Region  # noqa
 
 
 @fixture(autouse=__file__, scope="package")
@@ -32,3 +37,27 @@ def ignore_v1_warnings():
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", message=msg, category=DeprecationWarning)
         yield
+
+
+def region_totals(parent="sun", **kw):
+    """Get regions annotated with order totals computed in a "totals" CTE
+
+    :param parent: Parent of the regions whose orders are summed, or
+    `None` to sum all orders.
+    :param **kw: Keyword arguments passed to `CTE`.
+    :returns: A queryset of regions ordered by name.
+    """
+    orders = Order.objects.all()
+    if parent is not None:
+        orders = orders.filter(region__parent=parent)
+    totals = CTE(
+        orders.values("region_id").annotate(total=Sum("amount")),
+        name="totals",
+        **kw,
+    )
+    return with_cte(
+        totals,
+        select=totals.join(Region, name=totals.col.region_id)
+        .annotate(total=totals.col.total)
+        .order_by("name")
+    )
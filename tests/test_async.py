@@ -0,0 +1,116 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import IntegerField
+from django.db.models.aggregates import Sum
+from django.test import TestCase
+
+from django_cte import CTE, with_cte
+from django_cte.cache import acached, clear_local_cache, disconnect
+from django_cte.explain import acte_explain
+from django_cte.prepared import Placeholder, prepared, template
+from django_cte.streaming import astream
+
+from . import region_totals
+from .models import Order
+
+int_field = IntegerField()
+
+
+class TestAsync(TestCase):
+
+    async def test_queryset_methods(self):
+        regions = region_totals(parent=None)
+        expected = [r.name async for r in regions]
+        self.assertTrue(expected)
+        self.assertEqual(
+            [r.name async for r in regions.aiterator(chunk_size=3)],
+            expected,
+        )
+        self.assertEqual(await regions.acount(), len(expected))
+        self.assertTrue(await regions.aexists())
+        self.assertFalse(await regions.filter(total__lt=0).aexists())
+
+    async def test_astream(self):
+        # connections are thread local; patch the class of the connection
+        # of the thread in which queries are executed
+        backend = type(connections["default"])
+        regions = region_totals(parent=None)
+        expected = [(r.name, r.total) async for r in regions]
+        progress = []
+        with mock.patch.object(
+            backend, "chunked_cursor", autospec=True,
+            side_effect=backend.chunked_cursor,
+        ) as chunked_cursor:
+            data = [
+                (r.name, r.total)
+                async for r in astream(
+                    regions, chunk_size=4, progress=progress.append)
+            ]
+        self.assertEqual(data, expected)
+        self.assertEqual(
+            progress,
+            list(range(4, len(data), 4)) + [len(data)],
+        )
+        chunked_cursor.assert_called_once()
+
+    async def test_astream_temp_table(self):
+        regions = region_totals(parent=None, strategy="temp_table") \
+            .values_list("name", "total")
+        expected = [r async for r in regions]
+        self.assertEqual([r async for r in astream(regions, 2)], expected)
+
+    async def test_astream_close_before_exhausted(self):
+        regions = region_totals().values_list("name", flat=True)
+        items = astream(regions, chunk_size=2)
+        self.assertEqual(await items.__anext__(), "earth")
+        await items.aclose()
+        self.assertTrue(await Order.objects.aexists())
+
+    async def test_acached(self):
+        await cache.aclear()
+        clear_local_cache()
+        self.addCleanup(clear_local_cache)
+        self.addCleanup(disconnect)
+        data = [(r.name, r.total) for r in await acached(region_totals())]
+        self.assertEqual(
+            data, [(r.name, r.total) async for r in region_totals()])
+        self.assertIs(
+            await acached(region_totals()),
+            await acached(region_totals()),
+        )
+
+    async def test_prepared_aexecute(self):
+        query = prepared(region_totals().values_list("name", "total"))
+        self.assertEqual(
+            await query.aexecute(),
+            [r async for r in region_totals().values_list(
+                "name", "total")],
+        )
+
+    async def test_template_aexecute(self):
+        cte = CTE(
+            Order.objects
+            .filter(amount__gt=Placeholder("min_amount", int_field))
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+        )
+        regions = with_cte(
+            cte,
+            select=cte.queryset()
+            .values_list("region_id", flat=True)
+            .order_by("region_id")
+        )
+        query = template(regions)
+        self.assertEqual(
+            await query.aexecute(min_amount=30),
+            [r async for r in Order.objects.filter(amount__gt=30)
+             .values_list("region_id", flat=True)
+             .order_by("region_id").distinct()],
+        )
+
+    async def test_acte_explain(self):
+        result = await acte_explain(region_totals(), analyze=False)
+        self.assertEqual(list(result["ctes"]), ["totals"])
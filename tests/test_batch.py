@@ -0,0 +1,87 @@
+from unittest import mock
+
+from django.db import connection
+from django.db.models import IntegerField, Value
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_cte import CTE, with_cte
+from django_cte.batch import _can_pipeline, aexecute_batch, execute_batch
+
+from . import region_totals
+from .models import Order, Region
+
+int_field = IntegerField()
+
+
+class TestExecuteBatch(TestCase):
+
+    def make_querysets(self):
+        regions = region_totals(parent=None)
+
+        def make_regions_cte(cte):
+            return Region.objects.filter(parent__isnull=True).values(
+                "name",
+                depth=Value(0, output_field=int_field),
+            ).union(
+                cte.join(Region, parent=cte.col.name).values(
+                    "name",
+                    depth=cte.col.depth + Value(1, output_field=int_field),
+                ),
+                all=True,
+            )
+
+        tree = CTE.recursive(make_regions_cte)
+        depths = with_cte(
+            tree,
+            select=tree.queryset()
+            .values_list("name", "depth", named=True)
+            .order_by("depth", "name")
+        )
+        return [
+            regions,
+            regions.values("name", "total"),
+            regions.values_list("total", flat=True),
+            depths,
+            Order.objects.filter(amount__gt=40).order_by("amount"),
+            regions.none(),
+        ]
+
+    def test_execute_batch(self):
+        querysets = self.make_querysets()
+        expected = [list(qs.all()) for qs in querysets]
+        results = execute_batch(*querysets)
+        self.assertEqual(results, expected)
+        self.assertEqual(
+            [r.total for r in results[0]],
+            [r.total for r in expected[0]],
+        )
+        self.assertTrue(all(qs._result_cache is None for qs in querysets))
+
+    def test_pipeline(self):
+        querysets = self.make_querysets()
+        if not _can_pipeline(connection, querysets[0].query):
+            self.skipTest("pipeline mode requires PostgreSQL with psycopg 3")
+        raw = type(connection.connection)
+        with mock.patch.object(
+            raw, "pipeline", autospec=True, side_effect=raw.pipeline,
+        ) as pipeline, CaptureQueriesContext(connection) as queries:
+            execute_batch(*querysets)
+        pipeline.assert_called_once()
+        self.assertEqual(len(queries), len(querysets) - 1)
+
+    def test_temp_table_ctes_executed_sequentially(self):
+        regions = region_totals(parent=None, strategy="temp_table") \
+            .values_list("name", "total")
+        orders = Order.objects.values_list("amount", flat=True).order_by("id")
+        self.assertEqual(
+            execute_batch(regions, orders),
+            [list(regions), list(orders)],
+        )
+
+    async def test_aexecute_batch(self):
+        querysets = self.make_querysets()
+        expected = []
+        for qs in querysets:
+            expected.append([r async for r in qs])
+        self.assertEqual(await aexecute_batch(*querysets), expected)
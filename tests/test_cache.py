@@ -0,0 +1,143 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Subquery, TextField
+from django.test import TestCase, override_settings
+
+from django_cte import CTE, with_cte
+from django_cte.cache import (
+    cached,
+    clear_local_cache,
+    disconnect,
+    invalidate,
+)
+from django_cte.tables import get_tables
+from django_cte.raw import raw_cte_sql
+
+from . import region_totals
+from .models import Order, Region, User
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        self.addCleanup(clear_local_cache)
+        self.addCleanup(disconnect)
+
+    def test_get_tables(self):
+        self.assertEqual(
+            get_tables(region_totals().query),
+            {"orders", "region"},
+        )
+
+    def test_cached(self):
+        with self.assertNumQueries(1):
+            regions = cached(region_totals())
+        self.assertEqual([(r.name, r.total) for r in regions], [
+            ('earth', 126),
+            ('mars', 123),
+            ('mercury', 33),
+            ('venus', 86),
+        ])
+        with self.assertNumQueries(0):
+            self.assertEqual(cached(region_totals()), regions)
+
+        # results of other iterable classes are cached separately
+        with self.assertNumQueries(1):
+            values = cached(region_totals().values_list("name", "total"))
+        self.assertEqual(values[0], ("earth", 126))
+
+    def test_django_cache_tier(self):
+        regions = cached(region_totals())
+        clear_local_cache()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [r.name for r in cached(region_totals())],
+                [r.name for r in regions],
+            )
+
+    @override_settings(CTE_RESULT_CACHE_LOCAL_SIZE=0)
+    def test_without_local_cache(self):
+        cached(region_totals())
+        with self.assertNumQueries(0):
+            cached(region_totals())
+
+    def test_invalidate_on_save(self):
+        cached(region_totals())
+        order = Order.objects.get(region="earth", amount=30)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.amount = 35
+            order.save()
+            # not cached before commit
+            with self.assertNumQueries(1):
+                regions = cached(region_totals())
+            self.assertEqual(regions[0].total, 131)
+            with self.assertNumQueries(1):
+                cached(region_totals())
+        with self.assertNumQueries(1):
+            regions = cached(region_totals())
+        self.assertEqual(regions[0].total, 131)
+        with self.assertNumQueries(0):
+            cached(region_totals())
+
+    def test_rollback_does_not_invalidate(self):
+        regions = cached(region_totals())
+        with transaction.atomic():
+            Order.objects.filter(region="mercury").delete()
+            self.assertEqual(len(cached(region_totals())), 3)
+            transaction.set_rollback(True)
+        with self.assertNumQueries(0):
+            self.assertEqual(cached(region_totals()), regions)
+
+    def test_invalidate_on_delete(self):
+        cached(region_totals())
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.filter(region="mercury").delete()
+        regions = cached(region_totals())
+        self.assertEqual([r.name for r in regions], ["earth", "mars", "venus"])
+
+    def test_invalidate_by_order_by_subquery(self):
+        def make_queryset():
+            return Region.objects.filter(parent="sun").order_by(
+                Subquery(
+                    User.objects.filter(name=OuterRef("name"))
+                    .values("name")[:1]
+                ).desc(nulls_last=True),
+                "name",
+            ).values_list("name", flat=True)
+
+        self.assertEqual(cached(make_queryset())[0], "earth")
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create(name="venus")
+        with self.assertNumQueries(1):
+            self.assertEqual(cached(make_queryset())[0], "venus")
+
+    def test_unrelated_change_does_not_invalidate(self):
+        cached(region_totals())
+        User.objects.create(name="unrelated")
+        with self.assertNumQueries(0):
+            cached(region_totals())
+
+    def test_invalidate(self):
+        cached(region_totals())
+        Order.objects.filter(region="earth").update(amount=1)
+        with self.assertNumQueries(0):
+            cached(region_totals())
+        invalidate("orders")
+        regions = cached(region_totals())
+        self.assertEqual(regions[0].total, 4)
+        invalidate(Order)
+        with self.assertNumQueries(1):
+            cached(region_totals())
+
+    def test_raw_cte(self):
+        cte = CTE(raw_cte_sql(
+            "SELECT region_id, SUM(amount) AS total FROM orders "
+            "GROUP BY region_id",
+            [],
+            {"region_id": TextField(), "total": IntegerField()},
+        ))
+        regions = with_cte(cte, select=cte.join(Region, name=cte.col.region_id))
+        with self.assertRaises(ValueError):
+            cached(regions)
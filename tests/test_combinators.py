@@ -1,9 +1,12 @@
+from unittest import mock
+
 import pytest
 from django.db.models import Value
 from django.db.models.aggregates import Sum
+from django.db.models.sql import Query
 from django.test import TestCase
 
-from django_cte import CTE, with_cte
+from django_cte import CTE, union_all, with_cte
 
 from .models import Order
 
@@ -268,3 +271,88 @@ class TestCTECombinators(TestCase):
             (12, 'mercury', 33),
             (12, 'proxima centauri b', 33),
         ])
+
+    def test_union_all(self):
+        totals = CTE(
+            Order.objects
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+        )
+        regions = ["earth", "mars", "venus", "moon"]
+        branches = [
+            with_cte(
+                totals,
+                select=totals.join(
+                    Order.objects.filter(region_id=region),
+                    region=totals.col.region_id,
+                )
+                .annotate(region_total=totals.col.total)
+                .values_list("amount", "region_id", "region_total")
+            )
+            for region in regions
+        ]
+        # a non-CTE query may come first
+        plain_sun = (
+            Order.objects.filter(region_id="sun")
+            .annotate(region_total=Value(0))
+            .values_list("amount", "region_id", "region_total")
+        )
+        combined = union_all(plain_sun, *branches)
+        print(combined.query)
+
+        self.assertEqual(combined.query._with_ctes, (totals,))
+        self.assertEqual(str(combined.query).count("WITH RECURSIVE"), 1)
+        self.assertEqual(sorted(combined), [
+            (1, 'moon', 6),
+            (2, 'moon', 6),
+            (3, 'moon', 6),
+            (20, 'venus', 86),
+            (21, 'venus', 86),
+            (22, 'venus', 86),
+            (23, 'venus', 86),
+            (30, 'earth', 126),
+            (31, 'earth', 126),
+            (32, 'earth', 126),
+            (33, 'earth', 126),
+            (40, 'mars', 123),
+            (41, 'mars', 123),
+            (42, 'mars', 123),
+            (1000, 'sun', 0),
+        ])
+
+        # branches should still work on their own
+        self.assertEqual(branches[0].query._with_ctes, (totals,))
+        self.assertEqual(len(branches[0]), 4)
+
+    def test_union_all_does_not_clone_branches(self):
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        branches = [
+            with_cte(
+                totals,
+                select=totals.queryset()
+                .filter(total__gt=index)
+                .values_list("region_id", "total"),
+            )
+            for index in range(50)
+        ]
+        with mock.patch.object(Query, "clone", autospec=True,
+                               side_effect=Query.clone) as clone:
+            combined = union_all(*branches)
+        self.assertLessEqual(clone.call_count, 2)
+        self.assertEqual(combined.query._with_ctes, (totals,))
+        self.assertEqual(str(combined.query).count("WITH RECURSIVE"), 1)
+        self.assertEqual(
+            sorted(combined),
+            sorted(row for branch in branches for row in branch),
+        )
+
+    def test_union_all_with_duplicate_names(self):
+        one = CTE(Order.objects.values("region_id"))
+        two = CTE(Order.objects.values("region_id"))
+        msg = "Found two or more CTEs named 'cte'"
+        with pytest.raises(ValueError, match=msg):
+            union_all(with_cte(one, select=one), with_cte(two, select=two))
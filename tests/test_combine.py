@@ -0,0 +1,72 @@
+from django.db import connection
+from django.db.models import Count, Max, Min, Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_cte import CTE
+from django_cte.combine import acombine_aggregates, combine_aggregates
+
+from .models import Order
+
+
+class TestCombineAggregates(TestCase):
+
+    def make_cte(self):
+        return CTE(
+            Order.objects
+            .filter(region__parent="sun")
+            .values("region_id", "amount"),
+            name="base",
+            materialized=True,
+        )
+
+    def make_querysets(self, cte):
+        return {
+            "count": cte.queryset().values(count=Count("*")),
+            "total": cte.queryset().values(total=Sum("amount")),
+            "big": cte.queryset().filter(amount__gt=20).values(n=Count("*")),
+            "min": cte.queryset().values(min=Min("amount")),
+            "max": cte.queryset()
+            .filter(region_id="earth")
+            .values(max=Max("amount")),
+        }
+
+    def test_combine_aggregates(self):
+        cte = self.make_cte()
+        with CaptureQueriesContext(connection) as queries:
+            result = combine_aggregates(cte, self.make_querysets(cte))
+        print(queries[0]["sql"])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0]["sql"].count('"base" AS'), 1)
+
+        orders = Order.objects.filter(region__parent="sun")
+        self.assertEqual(result, {
+            "count": orders.count(),
+            "total": orders.aggregate(v=Sum("amount"))["v"],
+            "big": orders.filter(amount__gt=20).count(),
+            "min": orders.aggregate(v=Min("amount"))["v"],
+            "max": orders.filter(region_id="earth")
+            .aggregate(v=Max("amount"))["v"],
+        })
+
+    def test_empty_base(self):
+        cte = CTE(
+            Order.objects.filter(amount__lt=0).values("amount"),
+            name="base",
+        )
+        self.assertEqual(combine_aggregates(cte, {
+            "count": cte.queryset().values(count=Count("*")),
+            "total": cte.queryset().values(total=Sum("amount")),
+        }), {"count": 0, "total": None})
+
+    def test_no_querysets(self):
+        self.assertEqual(combine_aggregates(self.make_cte(), {}), {})
+
+    async def test_acombine_aggregates(self):
+        cte = self.make_cte()
+        result = await acombine_aggregates(cte, {
+            "count": cte.queryset().values(count=Count("*")),
+        })
+        self.assertEqual(result, {
+            "count": await Order.objects.filter(region__parent="sun").acount(),
+        })
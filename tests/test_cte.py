@@ -1,3 +1,7 @@
+import gc
+import weakref
+from unittest.mock import patch
+
 import pytest
 import django
 from django.db.models import IntegerField, TextField
@@ -8,9 +12,10 @@ from django.db.models.expressions import (
 from django.db.models.deletion import Collector
 from django.db.models.sql.constants import LOUTER
 from django.db.utils import OperationalError, ProgrammingError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from django_cte import CTE, with_cte
+from django_cte import CTE, fingerprint, with_cte
+from django_cte.raw import raw_cte_sql
 
 from .models import Order, Region, User, WithDBColumn
 
@@ -917,3 +922,401 @@ class TestCTE(TestCase):
                 'test2': "test_user",
             }
         ])
+
+    def test_cte_column_ref_is_cached(self):
+        cte = CTE(
+            Order.objects
+            .values("region_id")
+            .annotate(total=Sum("amount"))
+        )
+        ref = cte.col.total._ref
+        self.assertIs(cte.col.total._ref, ref)
+
+        # cache is invalidated when the query changes
+        cte.query = cte.query.clone()
+        self.assertIsNot(cte.col.total._ref, ref)
+
+    def test_cte_is_freed_without_garbage_collection(self):
+        cte = CTE(
+            Order.objects
+            .values("region_id")
+            .annotate(total=Sum("amount"))
+        )
+        cte.col.total.output_field
+        ref = weakref.ref(cte)
+        gc.disable()
+        try:
+            del cte
+            self.assertIsNone(ref())
+        finally:
+            gc.enable()
+
+    def test_cte_column_copy(self):
+        cte = CTE(Order.objects.values("region_id"))
+        column = cte.col.region_id
+        clone = column.relabeled_clone({"cte": "T2"})
+        self.assertIsNot(clone, column)
+        self.assertEqual(clone.table_alias, "T2")
+        self.assertEqual(clone.name, "region_id")
+        self.assertEqual(column.table_alias, "cte")
+
+    def test_cte_without_outer_ref_is_shared_by_subqueries(self):
+        cte = CTE(
+            Order.objects
+            .values("region_id")
+            .annotate(total=Sum("amount"))
+        )
+        cte_query = cte.query
+        clones = []
+        original_clone = type(cte_query).clone
+
+        def clone(query):
+            if query is cte_query:
+                clones.append(query)
+            return original_clone(query)
+
+        with patch.object(type(cte_query), "clone", clone):
+            regions = Region.objects.annotate(**{
+                f"total{i}": Subquery(
+                    with_cte(cte, select=cte.queryset())
+                    .filter(region_id=OuterRef("name"))
+                    .values("total")
+                )
+                for i in range(10)
+            })
+        for annotation in regions.query.annotations.values():
+            self.assertEqual(annotation.query._with_ctes, (cte,))
+            self.assertIs(annotation.query._with_ctes[0], cte)
+        self.assertEqual(clones, [])
+
+        data = {r.name: r.total0 for r in regions}
+        self.assertEqual(data["earth"], 126)
+
+    def test_hoist_subquery_ctes(self):
+        totals = CTE(
+            Order.objects
+            .values("region_id")
+            .annotate(total=Sum("amount"), count=Count("id")),
+            name="totals",
+        )
+
+        def region_total(field):
+            return Subquery(
+                with_cte(totals, select=totals.queryset())
+                .filter(region_id=OuterRef("name"))
+                .values(field)
+            )
+
+        regions = with_cte(
+            select=Region.objects.annotate(
+                total=region_total("total"),
+                count=region_total("count"),
+            )
+            .filter(parent_id="sun")
+            .order_by("name")
+        )
+        sql = str(regions.query)
+        print(sql)
+        self.assertTrue(sql.startswith('WITH RECURSIVE "totals" AS'), sql)
+        self.assertEqual(sql.count('"totals" AS'), 1, sql)
+
+        data = [(r.name, r.total, r.count) for r in regions]
+        self.assertEqual(data, [
+            ('earth', 126, 4),
+            ('mars', 123, 3),
+            ('mercury', 33, 3),
+            ('venus', 86, 4),
+        ])
+
+    def test_hoist_subquery_ctes_with_outerref(self):
+        min_and_max = CTE(
+            Order.objects
+            .filter(region=OuterRef("pk"))
+            .values('region')
+            .annotate(
+                amount_min=Min("amount"),
+                amount_max=Max("amount"),
+            )
+            .values('amount_min', 'amount_max')
+        )
+        regions = with_cte(
+            select=Region.objects.annotate(
+                difference=Subquery(
+                    with_cte(min_and_max, select=min_and_max)
+                    .annotate(
+                        difference=ExpressionWrapper(
+                            F('amount_max') - F('amount_min'),
+                            output_field=int_field,
+                        ),
+                    ).values('difference')[:1],
+                    output_field=IntegerField()
+                )
+            )
+            .filter(parent_id="sun")
+            .order_by("name")
+        )
+        sql = str(regions.query)
+        print(sql)
+        # correlated CTE must not be hoisted
+        self.assertFalse(sql.startswith("WITH"), sql)
+
+        data = [(r.name, r.difference) for r in regions]
+        self.assertEqual(data, [
+            ('earth', 3),
+            ('mars', 2),
+            ('mercury', 2),
+            ('venus', 3),
+        ])
+
+    def test_hoist_subquery_ctes_name_collision(self):
+        totals = CTE(
+            Order.objects
+            .values("region_id")
+            .annotate(total=Sum("amount"))
+        )
+        counts = CTE(
+            Order.objects
+            .values("region_id")
+            .annotate(total=Count("id"))
+        )
+
+        def region_total(cte):
+            return Subquery(
+                with_cte(cte, select=cte.queryset())
+                .filter(region_id=OuterRef("name"))
+                .values("total")
+            )
+
+        regions = with_cte(
+            select=Region.objects.annotate(
+                total=region_total(totals),
+                count=region_total(counts),
+            )
+            .filter(parent_id="sun")
+            .order_by("name")
+        )
+        sql = str(regions.query)
+        print(sql)
+        # different CTEs named "cte" must not be hoisted
+        self.assertFalse(sql.startswith("WITH"), sql)
+        self.assertEqual(sql.count('"cte" AS'), 2, sql)
+
+        data = [(r.name, r.total, r.count) for r in regions]
+        self.assertEqual(data, [
+            ('earth', 126, 4),
+            ('mars', 123, 3),
+            ('mercury', 33, 3),
+            ('venus', 86, 4),
+        ])
+
+    def test_fingerprint(self):
+        def make_cte(region, name="cte"):
+            return CTE(
+                Order.objects
+                .filter(region_id=region)
+                .values("region_id")
+                .annotate(total=Sum("amount")),
+                name=name,
+            )
+        earth = make_cte("earth")
+        self.assertEqual(
+            earth.fingerprint(), make_cte("earth", "other").fingerprint())
+        self.assertNotEqual(earth.fingerprint(), make_cte("mars").fingerprint())
+
+        def make_qs(cte):
+            return with_cte(cte, select=cte).order_by("region_id")
+        self.assertEqual(
+            fingerprint(make_qs(earth)),
+            fingerprint(make_qs(make_cte("earth"))),
+        )
+        self.assertNotEqual(
+            fingerprint(make_qs(earth)),
+            fingerprint(make_qs(make_cte("mars"))),
+        )
+
+    def test_identical_cte_bodies_are_merged(self):
+        def make_cte(name):
+            return CTE(
+                Order.objects
+                .filter(region__parent="sun")
+                .values("region_id")
+                .annotate(total=Sum("amount")),
+                name=name,
+            )
+        one = make_cte("one")
+        two = make_cte("two")
+        orders = with_cte(
+            one,
+            two,
+            select=two.join(
+                one.join(Order, region=one.col.region_id),
+                region=two.col.region_id,
+            )
+            .annotate(one_total=one.col.total, two_total=two.col.total)
+            .order_by("amount")
+        )
+        sql = str(orders.query)
+        self.assertEqual(sql.count("SUM("), 1, sql)
+        self.assertNotIn('"two" AS', sql)
+        self.assertIn('JOIN "one" "two" ON', sql)
+
+        data = [(o.amount, o.one_total, o.two_total) for o in orders][:3]
+        self.assertEqual(data, [
+            (10, 33, 33),
+            (11, 33, 33),
+            (12, 33, 33),
+        ])
+
+    def test_merged_cte_referenced_by_queryset_and_subquery(self):
+        def make_cte(name):
+            return CTE(
+                Order.objects
+                .filter(region__parent="sun")
+                .values("region_id")
+                .annotate(total=Sum("amount")),
+                name=name,
+            )
+        one = make_cte("one")
+        two = make_cte("two")
+        totals = with_cte(
+            one,
+            two,
+            select=two.queryset()
+            .annotate(one_total=Subquery(
+                one.queryset()
+                .filter(region_id=OuterRef("region_id"))
+                .values("total")
+            ))
+            .order_by("region_id")
+        )
+        sql = str(totals.query)
+        self.assertEqual(sql.count("SUM("), 1, sql)
+        self.assertIn('FROM "one" "two"', sql)
+
+        data = [(r["region_id"], r["total"], r["one_total"]) for r in totals]
+        self.assertEqual(data, [
+            ('earth', 126, 126),
+            ('mars', 123, 123),
+            ('mercury', 33, 33),
+            ('venus', 86, 86),
+        ])
+
+    @override_settings(CTE_CANONICAL_SQL=True)
+    def test_canonical_sql(self):
+        def make_query(*names):
+            ctes = {
+                name: CTE(
+                    Order.objects
+                    .filter(region__parent=name)
+                    .values("region_id")
+                    .annotate(total=Sum("amount")),
+                    name=name,
+                )
+                for name in names
+            }
+            return with_cte(
+                *ctes.values(),
+                select=Region.objects.annotate(
+                    sun_total=Subquery(
+                        ctes["sun"].queryset()
+                        .filter(region_id=OuterRef("name"))
+                        .values("total")
+                    ),
+                    earth_total=Subquery(
+                        ctes["earth"].queryset()
+                        .filter(region_id=OuterRef("name"))
+                        .values("total")
+                    ),
+                )
+            )
+        one = str(make_query("sun", "earth").query)
+        two = str(make_query("earth", "sun").query)
+        print(one)
+        self.assertEqual(one, two)
+        self.assertTrue(one.startswith('WITH RECURSIVE "earth" AS'), one)
+        totals = {r.name: r.sun_total for r in make_query("sun", "earth")}
+        self.assertEqual(totals["mars"], 123)
+
+    def test_canonicalize_aliases(self):
+        from django_cte.query import canonicalize_aliases
+        # the join of parent__parent is trimmed, leaving unused alias T3
+        regions = (
+            Region.objects
+            .filter(parent__parent__name="sun")
+            .filter(parent__region__name="moon")
+        )
+        self.assertIn("T4", str(regions.query))
+        query = canonicalize_aliases(regions.query)
+        print(query)
+        self.assertNotIn("T4", str(query))
+        self.assertIn('INNER JOIN "region" T3', str(query))
+        self.assertIn("T4", str(regions.query))
+        regions.query = query
+        self.assertEqual([r.name for r in regions], ["moon"])
+
+    @override_settings(CTE_CANONICAL_SQL=True)
+    def test_canonical_sql_with_raw_cte(self):
+        cte = CTE(raw_cte_sql(
+            """
+            SELECT region_id, SUM(amount) AS Q1
+            FROM orders GROUP BY region_id
+            """,
+            [],
+            # unquoted Q1 is folded to lower case on PostgreSQL
+            {"region_id": text_field, "q1": int_field},
+        ), name="totals")
+        regions = with_cte(
+            cte,
+            select=cte.join(Region, name=cte.col.region_id)
+            .annotate(total=cte.col.q1)
+            .filter(parent__parent__name="sun")
+            .order_by("name")
+        )
+        print(regions.query)
+        self.assertEqual(
+            [(r.name, r.total) for r in regions],
+            [("moon", 6)],
+        )
+
+    @override_settings(CTE_SQL_COMMENT=True)
+    def test_sql_comment(self):
+        def make_query(parent):
+            totals = CTE(
+                Order.objects
+                .filter(region__parent=parent)
+                .values("region_id")
+                .annotate(total=Sum("amount")),
+                name="totals",
+            )
+            regions = CTE(
+                Region.objects.filter(parent=parent).values("name"),
+                name="regions*/",
+            )
+            return with_cte(
+                totals,
+                regions,
+                select=totals.join(Region, name=totals.col.region_id)
+                .annotate(total=totals.col.total)
+                .order_by("name")
+            )
+        sql, params = make_query("sun").query.sql_with_params()
+        print(sql)
+        self.assertTrue(sql.startswith(
+            "/* ctes=totals,regions* /; "
+            "origin=tests.test_cte.TestCTE.test_sql_comment */ WITH"
+        ) or sql.startswith(
+            # Python < 3.11: no qualified name
+            "/* ctes=totals,regions* /; "
+            "origin=tests.test_cte.test_sql_comment */ WITH"
+        ), sql)
+        self.assertEqual(sql.count("/*"), 1, sql)
+        self.assertEqual(sql, make_query("earth").query.sql_with_params()[0])
+        key = fingerprint(make_query("sun"))
+        with override_settings(CTE_SQL_COMMENT=False):
+            self.assertEqual(fingerprint(make_query("sun")), key)
+
+        data = [(r.name, r.total) for r in make_query("sun")]
+        self.assertEqual(data[0], ("earth", 126))
+        with override_settings(CTE_SQL_COMMENT=["ctes"]):
+            sql = str(make_query("sun").query)
+        self.assertTrue(sql.startswith("/* ctes=totals,regions* / */"), sql)
@@ -0,0 +1,82 @@
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test import TestCase
+
+from django_cte import CTE, with_cte
+from django_cte.explain import cte_explain
+
+from . import region_totals
+from .models import Order, Region
+
+
+class TestExplain(TestCase):
+
+    def test_cte_explain(self):
+        totals = CTE(
+            Order.objects
+            .filter(region__parent="sun")
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+            materialized=True,
+        )
+        region_count = CTE(
+            Region.objects
+            .filter(parent="sun")
+            .values("parent_id")
+            .annotate(num=Count("name")),
+            name="region_count",
+            materialized=True,
+        )
+        orders = with_cte(
+            totals,
+            region_count,
+            select=region_count.join(
+                totals.join(Order, region=totals.col.region_id),
+                region__parent=region_count.col.parent_id
+            )
+            .annotate(region_total=totals.col.total)
+            .annotate(region_count=region_count.col.num)
+            .order_by("amount")
+        )
+        result = cte_explain(orders)
+        print(result["plan"])
+
+        ctes = result["ctes"]
+        self.assertEqual(set(ctes), {"totals", "region_count"})
+        for name, info in ctes.items():
+            self.assertEqual(info["name"], name)
+            self.assertFalse(info["inlined"], name)
+            self.assertEqual(len(info["scans"]), 1, name)
+
+        totals = ctes["totals"]
+        if connection.vendor == "postgresql":
+            self.assertEqual(totals["node"]["Subplan Name"], "CTE totals")
+            self.assertEqual(totals["actual_rows"], 4)
+            self.assertGreater(totals["total_cost"], 0)
+            self.assertIn("shared_hit_blocks", totals)
+            self.assertEqual(totals["scans"][0]["actual_rows"], 4)
+        else:
+            self.assertEqual(totals["node"]["detail"], "MATERIALIZE totals")
+            self.assertTrue(totals["materialized"])
+
+    def test_cte_explain_without_analyze(self):
+        result = cte_explain(region_totals(materialized=True), analyze=False)
+        totals = result["ctes"]["totals"]
+        self.assertFalse(totals["inlined"])
+        self.assertNotIn("actual_rows", totals)
+
+    def test_inlined_cte(self):
+        cte = CTE(Region.objects.filter(parent="sun"), name="planets")
+        regions = with_cte(cte, select=cte.queryset())
+        info = cte_explain(regions, analyze=False)["ctes"]["planets"]
+        self.assertEqual(info, {
+            "name": "planets",
+            "inlined": True,
+            "node": None,
+            "scans": [],
+        })
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            cte_explain(region_totals(), format="text")
@@ -0,0 +1,141 @@
+from concurrent.futures import Executor, Future
+
+from django.db.models import Q
+from django.db.models.aggregates import Count, Sum
+from django.test import TestCase
+
+from django_cte import CTE, with_cte
+from django_cte.parallel import (
+    execute_partitioned,
+    partition_ranges,
+    reaggregate,
+)
+
+from .models import Order, Region
+
+
+class SerialExecutor(Executor):
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted.append(args)
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+class TestExecutePartitioned(TestCase):
+
+    def test_partition_ranges(self):
+        self.assertEqual(partition_ranges("amount", [None, 10, 20, None]), [
+            Q(amount__lt=10),
+            Q(amount__gte=10, amount__lt=20),
+            Q(amount__gte=20),
+        ])
+
+    def test_partitions_pushed_into_cte(self):
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        regions = with_cte(
+            totals,
+            select=totals.join(Region, name=totals.col.region_id)
+            .annotate(total=totals.col.total)
+            .order_by("name")
+        )
+        executor = SerialExecutor()
+        partitions = partition_ranges("region_id", [None, "m", None])
+        data = [
+            (r.name, r.total)
+            for r in execute_partitioned(
+                regions, totals, partitions, executor=executor)
+        ]
+        self.assertEqual(data, [(r.name, r.total) for r in regions])
+        sqls = [str(args[0].query) for args in executor.submitted]
+        for sql in sqls:
+            print(sql)
+        self.assertEqual(len(sqls), 2)
+        self.assertIn('"orders"."region_id" < m', sqls[0])
+        self.assertIn('"orders"."region_id" >= m', sqls[1])
+        # the original queryset is not modified
+        self.assertNotIn("< m", str(regions.query))
+
+    def test_thread_pool(self):
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        regions = with_cte(
+            totals,
+            select=totals.join(Region, name=totals.col.region_id)
+            .annotate(total=totals.col.total)
+            .order_by("name")
+        )
+        partitions = partition_ranges("region_id", [None, "f", "p", None])
+        self.assertEqual(
+            [(r.name, r.total) for r in execute_partitioned(
+                regions, totals, partitions, max_workers=2)],
+            [(r.name, r.total) for r in regions],
+        )
+
+    def test_reaggregate(self):
+        orders = CTE(
+            Order.objects.values("region_id", "amount"),
+            name="orders_cte",
+        )
+        totals = with_cte(
+            orders,
+            select=orders.queryset()
+            .values("region_id")
+            .annotate(total=Sum("amount"), count=Count("*"))
+            .order_by("region_id")
+        )
+        partitions = partition_ranges("amount", [None, 10, 30, None])
+        data = execute_partitioned(
+            totals, orders, partitions,
+            executor=SerialExecutor(),
+            aggregates={"total": "sum", "count": "count"},
+        )
+        self.assertEqual(
+            sorted(data, key=lambda row: row["region_id"]),
+            list(totals),
+        )
+
+    def test_reaggregate_min_max(self):
+        rows = [
+            {"key": 1, "min": 3, "max": None},
+            {"key": 2, "min": 1, "max": 1},
+            {"key": 1, "min": 2, "max": 5},
+        ]
+        self.assertEqual(reaggregate(rows, {"min": "min", "max": "max"}), [
+            {"key": 1, "min": 2, "max": 5},
+            {"key": 2, "min": 1, "max": 1},
+        ])
+
+    def test_invalid_arguments(self):
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        regions = with_cte(
+            totals,
+            select=totals.join(Region, name=totals.col.region_id)
+            .annotate(total=totals.col.total)
+            .order_by("name")
+        )
+        other = CTE(Order.objects.values("amount"), name="other")
+        with self.assertRaises(ValueError):
+            execute_partitioned(regions, other, [Q()])
+        with self.assertRaises(ValueError):
+            execute_partitioned(regions, totals, [Q()], aggregates={
+                "total": "avg",
+            })
+        with self.assertRaises(ValueError):
+            list(execute_partitioned(
+                regions, totals, [Q()],
+                executor=SerialExecutor(),
+                aggregates={"total": "sum"},
+            ))
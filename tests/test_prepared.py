@@ -0,0 +1,184 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import SkipTest
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import F, IntegerField, Value
+from django.db.models.functions import Left, LPad, Repeat, Round, Substr
+from django.db.models.aggregates import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_cte import CTE, with_cte
+from django_cte.prepared import (
+    Placeholder,
+    get_prepare_sql,
+    prepared,
+    template,
+)
+
+from . import region_totals
+from .models import Order, Region
+
+
+class TestPreparedQuery(TestCase):
+
+    def setUp(self):
+        if self.is_pg():
+            with connection.cursor() as cursor:
+                cursor.execute("DEALLOCATE ALL")
+            connection._cte_prepared_statements = None
+
+    def test_prepared_query(self):
+        regions = region_totals()
+        query = prepared(regions)
+        print(query.sql)
+
+        for x in range(3):
+            # PREPARE + EXECUTE on first execution with PostgreSQL
+            num = 2 if x == 0 and self.is_pg() else 1
+            with self.assertNumQueries(num):
+                data = [(r.name, r.total) for r in query.execute()]
+            self.assertEqual(data, [(r.name, r.total) for r in regions])
+        self.assertTrue(all(isinstance(r, Region) for r in query.execute()))
+
+    def test_prepared_values_query(self):
+        query = prepared(region_totals().values_list("name", "total"))
+        self.assertEqual(query.execute(), [
+            ('earth', 126),
+            ('mars', 123),
+            ('mercury', 33),
+            ('venus', 86),
+        ])
+
+    def test_execute_with_params(self):
+        query = prepared(region_totals().values_list("total", flat=True))
+        self.assertEqual(query.params, ("sun",))
+        self.assertEqual(query.execute(["earth"]), [6])
+        self.assertEqual(query.execute(), [126, 123, 33, 86])
+        with self.assertRaises(ValueError):
+            query.execute([])
+
+    def test_concurrent_execute(self):
+        query = prepared(region_totals().values_list("total", flat=True))
+        expected = {
+            "sun": query.execute(),
+            "earth": query.execute(["earth"]),
+            "mars": query.execute(["mars"]),
+        }
+
+        def execute(parent):
+            try:
+                return parent, query.execute([parent])
+            finally:
+                connections[DEFAULT_DB_ALIAS].close()
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(execute, list(expected) * 10))
+        self.assertEqual(results, [(p, expected[p]) for p in expected] * 10)
+        self.assertEqual(query.execute(), expected["sun"])
+
+    def test_postgres_prepare_and_execute(self):
+        if not self.is_pg():
+            raise SkipTest("PostgreSQL only")
+        query = prepared(region_totals())
+        with CaptureQueriesContext(connection) as queries:
+            query.execute()
+            query.execute()
+        sqls = [q["sql"] for q in queries]
+        self.assertTrue(sqls[0].startswith("PREPARE django_cte_"), sqls)
+        self.assertEqual(len(sqls), 3, sqls)
+        self.assertTrue(sqls[1].startswith("EXECUTE django_cte_"), sqls)
+        self.assertEqual(sqls[1], sqls[2])
+
+    def test_numeric_function_arguments(self):
+        # parameters must not be typed more strictly than literals in
+        # unprepared SQL (e.g., as bigint when only integer is accepted)
+        orders = Order.objects.annotate(
+            prefix=Left("region_id", 2),
+            suffix=Substr("region_id", 2, 3),
+            padded=LPad("region_id", 8, Value("-")),
+            repeated=Repeat(Value("ab"), 2),
+            rounded=Round(F("amount") * 1.5, 1),
+            one=Value(1),
+            half=Value(0.5),
+        ).values_list(
+            "prefix", "suffix", "padded", "repeated", "rounded", "one", "half",
+        ).order_by("id")
+        self.assertEqual(prepared(orders).execute(), list(orders))
+
+    def test_get_prepare_sql(self):
+        sql = """SELECT "a" FROM "b" WHERE "a" LIKE %s || '%%' AND "c" = %s"""
+        self.assertEqual(
+            get_prepare_sql("stmt", sql, ["unknown", "bigint"]),
+            "PREPARE stmt (unknown, bigint) AS SELECT \"a\" FROM \"b\" "
+            "WHERE \"a\" LIKE $1 || '%' AND \"c\" = $2",
+        )
+
+    def is_pg(self):
+        return connection.vendor == "postgresql"
+
+
+class TestQueryTemplate(TestCase):
+
+    def test_template(self):
+        totals = CTE(
+            Order.objects
+            .filter(region__parent=Placeholder("parent"))
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+        )
+        orders = with_cte(
+            totals,
+            select=totals.join(Order, region=totals.col.region_id)
+            .annotate(region_total=totals.col.total)
+            .filter(amount__gte=Placeholder("amount", IntegerField()))
+            .order_by("amount")
+        )
+        query = template(orders)
+        print(query.sql)
+        self.assertEqual(query.slots, {"parent": [0], "amount": [1]})
+
+        orders = query.execute(parent="sun", amount="40")
+        self.assertTrue(all(isinstance(o, Order) for o in orders))
+        self.assertEqual(
+            [(o.amount, o.region_total) for o in orders],
+            [(40, 123), (41, 123), (42, 123)],
+        )
+        orders = query.execute(parent="earth", amount=2)
+        self.assertEqual(
+            [(o.amount, o.region_total) for o in orders],
+            [(2, 6), (3, 6)],
+        )
+
+    def test_template_values_query(self):
+        query = template(
+            region_totals(parent=Placeholder("parent"))
+            .filter(total__gte=Placeholder("amount", IntegerField()))
+            .values_list("name", flat=True)
+        )
+        self.assertEqual(
+            query.execute(parent="sun", amount=100),
+            ["earth", "mars"],
+        )
+
+    def test_repeated_placeholder(self):
+        orders = with_cte(
+            select=Order.objects.filter(
+                amount__gte=Placeholder("amount"),
+                amount__lte=Placeholder("amount"),
+            ).values_list("region_id", flat=True)
+        )
+        query = template(orders)
+        self.assertEqual(query.slots, {"amount": [0, 1]})
+        self.assertEqual(query.execute(amount=33), ["earth"])
+        self.assertEqual(query.execute(amount=21), ["venus"])
+
+    def test_missing_and_unknown_values(self):
+        query = template(
+            region_totals(parent=Placeholder("parent"))
+            .filter(total__gte=Placeholder("amount", IntegerField()))
+        )
+        with self.assertRaisesRegex(ValueError, "Missing .*'amount'"):
+            query.execute(parent="sun")
+        with self.assertRaisesRegex(ValueError, "Unknown .*'other'"):
+            query.execute(parent="sun", amount=1, other=2)
@@ -131,6 +131,52 @@ class TestRecursiveCTE(TestCase):
             (['sun', 'venus'], 1),
         ])
 
+    def test_recursive_cte_with_declared_columns(self):
+        def make_regions_cte(cte):
+            return Region.objects.filter(
+                parent__isnull=True
+            ).values(
+                "name",
+                depth=Value(0, output_field=int_field),
+                is_planet=Value(0, output_field=int_field),
+            ).union(
+                cte.join(
+                    Region, parent=cte.col.name
+                ).annotate(
+                    # no ExpressionWrapper needed with declared columns
+                    parent_name=cte.col.name,
+                    parent_depth=cte.col.depth,
+                ).filter(
+                    ~Q(parent_name="mars"),
+                ).values(
+                    "name",
+                    depth=cte.col.depth + 1,
+                    is_planet=Case(
+                        When(parent_depth=0, then=Value(1)),
+                        default=Value(0),
+                        output_field=int_field,
+                    ),
+                ),
+                all=True,
+            )
+        cte = CTE.recursive(make_regions_cte, columns={
+            "name": text_field,
+            "depth": int_field,
+            "is_planet": int_field,
+        })
+        regions = with_cte(cte, select=cte).filter(depth=1).order_by("name")
+        print(regions.query)
+
+        data = [(r["name"], r["is_planet"]) for r in regions]
+        self.assertEqual(data, [
+            ('earth', 1),
+            ('mars', 1),
+            ('mercury', 1),
+            ('proxima centauri b', 1),
+            ('venus', 1),
+        ])
+        self.assertIs(cte.col.depth.output_field, int_field)
+
     def test_recursive_cte_with_empty_union_part(self):
         def make_regions_cte(cte):
             return Region.objects.none().union(
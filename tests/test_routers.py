@@ -0,0 +1,157 @@
+from django.db.models import IntegerField, TextField
+from django.db.models.aggregates import Sum
+from django.test import TestCase, override_settings
+
+from django_cte import CTE, with_cte
+from django_cte.raw import raw_cte_sql
+from django_cte.routers import CTEReplicaRouter, get_cte_tables_read
+
+from .models import Order, Region
+
+ROUTER_SETTINGS = dict(
+    DATABASE_ROUTERS=["django_cte.routers.CTEReplicaRouter"],
+    CTE_READ_REPLICAS=["replica"],
+)
+
+
+@override_settings(**ROUTER_SETTINGS)
+class TestCTEReplicaRouter(TestCase):
+
+    def test_read_only_cte_query_routed_to_replica(self):
+        cte = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        orders = with_cte(
+            cte,
+            select=cte.join(Region, name=cte.col.region_id)
+            .annotate(total=cte.col.total)
+        )
+        self.assertEqual(orders.db, "replica")
+        self.assertEqual(orders.filter(total__gt=10).db, "replica")
+
+    def test_data_modifying_cte_routed_to_primary(self):
+        cte = CTE(raw_cte_sql(
+            "DELETE FROM orders WHERE amount = %s RETURNING region_id",
+            [0],
+            {"region_id": TextField()},
+            reads=["orders"],
+            writes=["orders"],
+        ), name="deleted")
+        regions = with_cte(cte, select=cte.join(
+            Region, name=cte.col.region_id))
+        self.assertEqual(regions.db, "default")
+
+    def test_raw_cte_with_undeclared_dependencies_routed_to_primary(self):
+        cte = CTE(raw_cte_sql(
+            "SELECT region_id, amount FROM orders",
+            [],
+            {"region_id": TextField(), "amount": IntegerField()},
+        ), name="raw")
+        regions = with_cte(cte, select=cte.join(
+            Region, name=cte.col.region_id))
+        self.assertEqual(regions.db, "default")
+
+    def test_query_without_ctes_not_routed(self):
+        self.assertEqual(Order.objects.all().db, "default")
+        self.assertIsNone(CTEReplicaRouter().db_for_read(Order))
+
+    def test_update_routed_to_primary(self):
+        cte = CTE(Order.objects.values("id"), name="ids")
+        orders = with_cte(cte, select=Order.objects.all())
+        self.assertEqual(orders.db, "replica")
+        self.assertEqual(orders.select_for_update().db, "default")
+
+    def test_all_writes_routed_to_primary(self):
+        router = CTEReplicaRouter()
+        self.assertEqual(router.db_for_write(Order), "default")
+        self.assertEqual(Order.objects.select_for_update().db, "default")
+        region = Region(name="pluto")
+        region.save()
+        self.assertEqual(region._state.db, "default")
+
+    def test_allow_relation(self):
+        router = CTEReplicaRouter()
+        primary = Region.objects.get(name="sun")
+        replica = Region(name="pluto")
+        replica._state.db = "replica"
+        self.assertIs(router.allow_relation(primary, replica), True)
+        self.assertIs(router.allow_relation(replica, replica), True)
+        other = Region(name="ceres")
+        other._state.db = "other"
+        self.assertIsNone(router.allow_relation(primary, other))
+        # related object read from a replica can be assigned
+        order = Order(amount=1, region=replica)
+        self.assertEqual(order.region_id, "pluto")
+
+    def test_choose_replica(self):
+        class Router(CTEReplicaRouter):
+            def choose_replica(self, model, tables):
+                return "orders_replica" if "orders" in tables else None
+
+        cte = CTE(Order.objects.values("region_id"), name="orders_cte")
+        regions = with_cte(cte, select=Region.objects.filter(
+            name__in=cte.queryset().values("region_id")))
+        router = Router()
+        self.assertEqual(
+            router.db_for_read(Region, **regions._hints), "orders_replica")
+        cte = CTE(Region.objects.values("name"), name="regions")
+        regions = with_cte(cte, select=Region.objects.all())
+        self.assertIsNone(router.db_for_read(Region, **regions._hints))
+
+    def test_data_modifying_cte_in_subquery_routed_to_primary(self):
+        deleted = CTE(raw_cte_sql(
+            "DELETE FROM orders WHERE amount = %s RETURNING region_id",
+            [0],
+            {"region_id": TextField()},
+            reads=["orders"],
+            writes=["orders"],
+        ), name="deleted")
+        totals = CTE(Order.objects.values("region_id"), name="totals")
+        regions = with_cte(totals, select=Region.objects.filter(
+            name__in=totals.queryset().values("region_id"),
+        ).filter(
+            name__in=with_cte(deleted, select=deleted.join(
+                Region, name=deleted.col.region_id,
+            )).values("name"),
+        ))
+        self.assertEqual(regions.db, "default")
+
+    def test_raw_cte_with_undeclared_writes_routed_to_primary(self):
+        def make_regions(writes):
+            cte = CTE(raw_cte_sql(
+                "SELECT region_id FROM orders",
+                [],
+                {"region_id": TextField()},
+                reads=["orders"],
+                writes=writes,
+            ), name="raw")
+            return with_cte(cte, select=cte.join(
+                Region, name=cte.col.region_id))
+
+        self.assertEqual(make_regions(None).db, "default")
+        self.assertEqual(make_regions([]).db, "replica")
+
+    def test_choose_replica_with_tables_of_referenced_ctes(self):
+        tables = []
+
+        class Router(CTEReplicaRouter):
+            def choose_replica(self, model, tables_read):
+                tables.append(tables_read)
+                return "replica"
+
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        large = CTE(totals.queryset().filter(total__gt=100), name="large")
+        regions = with_cte(
+            totals, large,
+            select=large.join(Region, name=large.col.region_id),
+        )
+        Router().db_for_read(Region, **regions._hints)
+        self.assertEqual(tables, [{"orders", "region"}])
+
+    def test_get_cte_tables_read(self):
+        cte = CTE(Order.objects.values("amount"), name="amounts")
+        self.assertEqual(get_cte_tables_read([cte]), {"orders"})
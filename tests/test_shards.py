@@ -0,0 +1,140 @@
+from django.db.models import F
+from django.db.models.aggregates import Count, Max, Min, Sum
+from django.test import TestCase
+
+from django_cte import CTE, with_cte
+from django_cte.shards import execute_sharded
+
+from . import region_totals
+from .models import Order, Region
+from .test_parallel import SerialExecutor
+
+# the test database stands for two shards with identical data
+SHARDS = ["default", "default"]
+
+
+class TestExecuteSharded(TestCase):
+
+    def execute(self, queryset, **kw):
+        return execute_sharded(
+            queryset, SHARDS, executor=SerialExecutor(), **kw)
+
+    def test_merge_ordered(self):
+        regions = region_totals(parent=None).order_by("-total", "name")
+        data = [(r.name, r.total) for r in self.execute(regions)]
+        expected = [(r.name, r.total) for r in regions]
+        self.assertEqual(data, [row for row in expected for _ in SHARDS])
+
+    def test_merge_values(self):
+        regions = region_totals(parent=None).values("name", "total")
+        for ordering in [("total", "name"), (F("total").desc(), "-name")]:
+            qs = regions.order_by(*ordering)
+            self.assertEqual(
+                self.execute(qs),
+                [row for row in qs for _ in SHARDS],
+            )
+
+    def test_merge_values_list(self):
+        regions = region_totals(parent=None).values_list("name", flat=True)
+        qs = regions.order_by("-name")
+        self.assertEqual(
+            self.execute(qs),
+            [row for row in qs for _ in SHARDS],
+        )
+        qs = regions.order_by("total")
+        with self.assertRaises(ValueError):
+            self.execute(qs)
+
+    def test_reverse_and_default_ordering(self):
+        orders = Order.objects.values_list("id", "amount")
+        qs = orders.order_by("amount", "id").reverse()
+        self.assertEqual(
+            self.execute(qs),
+            [row for row in qs for _ in SHARDS],
+        )
+
+    def test_slice(self):
+        regions = region_totals(parent=None).order_by("name")
+        expected = [r.name for r in regions for _ in SHARDS]
+        self.assertEqual(
+            [r.name for r in self.execute(regions.all()[:3])], expected[:3])
+        executor = SerialExecutor()
+        data = execute_sharded(regions.all()[3:7], SHARDS, executor=executor)
+        self.assertEqual([r.name for r in data], expected[3:7])
+        self.assertEqual(
+            [(args[0].query.low_mark, args[0].query.high_mark)
+             for args in executor.submitted],
+            [(0, 7)] * len(SHARDS),
+        )
+
+    def test_unordered(self):
+        orders = Order.objects.values_list("amount", flat=True)
+        self.assertEqual(
+            sorted(self.execute(orders)),
+            sorted(list(orders) * len(SHARDS)),
+        )
+
+    def test_aggregates(self):
+        cte = CTE(Order.objects.values("region_id", "amount"), name="base")
+        totals = with_cte(
+            cte,
+            select=cte.queryset()
+            .values("region_id")
+            .annotate(
+                total=Sum("amount"),
+                count=Count("*"),
+                min=Min("amount"),
+                max=Max("amount"),
+            )
+            .order_by("-total", "region_id")
+        )
+        data = self.execute(totals[:3], aggregates={
+            "total": "sum",
+            "count": "count",
+            "min": "min",
+            "max": "max",
+        })
+        self.assertEqual(data, [
+            {**row, "total": row["total"] * 2, "count": row["count"] * 2}
+            for row in totals[:3]
+        ])
+
+    def test_thread_pool(self):
+        regions = region_totals(parent=None).order_by("name")
+        self.assertEqual(
+            [r.name for r in execute_sharded(regions, SHARDS)],
+            [r.name for r in regions for _ in SHARDS],
+        )
+
+    def test_invalid_ordering(self):
+        regions = region_totals(parent=None).order_by("parent__name")
+        with self.assertRaises(ValueError):
+            self.execute(regions)
+
+    def test_ordering_not_selected(self):
+        regions = region_totals(parent=None)
+        for qs in [
+            regions.values("name").order_by("total"),
+            regions.values_list("name").order_by("total"),
+            Region.objects.values("name").order_by("parent"),
+        ]:
+            with self.subTest(qs=qs):
+                with self.assertRaisesRegex(ValueError, "not selected"):
+                    self.execute(qs)
+
+    def test_nulls_ordering(self):
+        regions = Region.objects.values_list("parent", "name")
+        for ordering in [
+            ("parent", "name"),
+            ("-parent", "name"),
+            (F("parent").asc(nulls_first=True), "name"),
+            (F("parent").asc(nulls_last=True), "name"),
+            (F("parent").desc(nulls_first=True), "name"),
+            (F("parent").desc(nulls_last=True), "name"),
+        ]:
+            qs = regions.order_by(*ordering)
+            with self.subTest(ordering=ordering):
+                self.assertEqual(
+                    self.execute(qs),
+                    [row for row in qs for _ in SHARDS],
+                )
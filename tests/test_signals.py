@@ -0,0 +1,87 @@
+from django.db.models import OuterRef, Subquery
+from django.db.models.aggregates import Sum
+from django.test import TestCase
+
+from django_cte import CTE, with_cte
+from django_cte.signals import cte_compiled, cte_query_compiled
+
+from .models import Order, Region
+
+
+class TestSignals(TestCase):
+
+    def setUp(self):
+        self.ctes = []
+        self.queries = []
+
+        def on_cte_compiled(**kw):
+            self.ctes.append(kw)
+
+        def on_query_compiled(**kw):
+            self.queries.append(kw)
+
+        cte_compiled.connect(on_cte_compiled)
+        cte_query_compiled.connect(on_query_compiled)
+        self.addCleanup(cte_compiled.disconnect, on_cte_compiled)
+        self.addCleanup(cte_query_compiled.disconnect, on_query_compiled)
+
+    def test_signals(self):
+        totals = CTE(
+            Order.objects
+            .filter(region__parent="sun")
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+        )
+        regions = CTE(
+            Region.objects.filter(parent="sun").values("name"),
+            name="regions",
+            materialized=True,
+        )
+        orders = with_cte(
+            totals,
+            regions,
+            select=totals.join(Order, region=totals.col.region_id)
+            .annotate(region_total=totals.col.total)
+        )
+        sql, params = orders.query.sql_with_params()
+
+        self.assertEqual([c["name"] for c in self.ctes], ["totals", "regions"])
+        totals_info = self.ctes[0]
+        self.assertIs(totals_info["sender"], CTE)
+        self.assertIs(totals_info["cte"], totals)
+        self.assertEqual(totals_info["param_count"], 1)
+        self.assertFalse(totals_info["materialized"])
+        self.assertFalse(totals_info["hoisted"])
+        self.assertGreater(totals_info["sql_length"], 0)
+        self.assertGreaterEqual(totals_info["duration"], 0)
+        self.assertTrue(self.ctes[1]["materialized"])
+
+        [query_info] = self.queries
+        self.assertIs(query_info["sender"], Order)
+        self.assertEqual(query_info["sql_length"], len(sql))
+        self.assertEqual(query_info["param_count"], len(params))
+        self.assertEqual(query_info["cte_count"], 2)
+        self.assertGreaterEqual(
+            query_info["duration"],
+            sum(c["duration"] for c in self.ctes),
+        )
+
+    def test_signals_with_subquery(self):
+        cte = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        totals = with_cte(cte, select=cte).filter(region_id=OuterRef("name"))
+        regions = with_cte(
+            select=Region.objects.annotate(
+                total=Subquery(totals.values("total")[:1]),
+            )
+        )
+        list(regions)
+
+        [cte_info] = self.ctes
+        self.assertEqual(cte_info["name"], "totals")
+        self.assertTrue(cte_info["hoisted"])
+        [query_info] = self.queries
+        self.assertIs(query_info["sender"], Region)
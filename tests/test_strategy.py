@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.db.models.aggregates import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from django_cte import CTE, with_cte
+from django_cte import strategy
+
+from . import region_totals
+from .models import Order, Region
+
+
+class TestStrategy(TestCase):
+
+    def setUp(self):
+        strategy.clear_cache()
+        self.addCleanup(strategy.clear_cache)
+
+    def test_inline_strategy(self):
+        regions = region_totals(strategy="inline")
+        print(regions.query)
+        self.assertIn('"totals" AS NOT MATERIALIZED (', str(regions.query))
+        data = [(r.name, r.total) for r in regions]
+        self.assertEqual(data, [
+            ('earth', 126),
+            ('mars', 123),
+            ('mercury', 33),
+            ('venus', 86),
+        ])
+
+    def test_materialized_strategy(self):
+        regions = region_totals(strategy="materialized")
+        self.assertIn('"totals" AS MATERIALIZED (', str(regions.query))
+
+    def test_auto_strategy(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = [(r.name, r.total) for r in region_totals(strategy="auto")]
+        self.assertEqual(data[0], ('earth', 126))
+        explains = [q for q in queries if q["sql"].startswith("EXPLAIN")]
+        if connection.vendor == "postgresql":
+            # inline, then materialized
+            self.assertEqual(len(explains), 2, explains)
+            self.assertIn("NOT MATERIALIZED", explains[0]["sql"])
+            self.assertIn("AS MATERIALIZED", explains[1]["sql"])
+        else:
+            self.assertEqual(explains, [])
+            self.assertIn('"totals" AS (', queries[0]["sql"])
+
+        # decision is cached
+        with CaptureQueriesContext(connection) as queries:
+            list(region_totals(strategy="auto"))
+        self.assertEqual(len(queries), 1)
+
+        # decisions are cached per query, not per parameters
+        with CaptureQueriesContext(connection) as queries:
+            list(region_totals(parent="earth", strategy="auto"))
+        self.assertEqual(len(queries), 1)
+
+    def test_auto_strategy_not_chosen_when_compiled(self):
+        regions = region_totals(strategy="auto")
+        with self.assertNumQueries(0):
+            sql = str(regions.query)
+        self.assertIn('"totals" AS (', sql)
+
+    def test_auto_strategy_in_correlated_subquery(self):
+        totals = CTE(
+            Order.objects
+            .filter(region=OuterRef("name"))
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+            strategy="auto",
+        )
+        regions = (
+            Region.objects
+            .annotate(total=Subquery(
+                with_cte(totals, select=totals.queryset()).values("total")
+            ))
+            .filter(parent="sun")
+            .order_by("name")
+        )
+        print(regions.query)
+        with CaptureQueriesContext(connection) as queries:
+            data = [(r.name, r.total) for r in regions]
+        self.assertEqual(len(queries), 1, queries)
+        self.assertEqual(data, [
+            ('earth', 126),
+            ('mars', 123),
+            ('mercury', 33),
+            ('venus', 86),
+        ])
+
+    def test_choose_strategies(self):
+        pg = SimpleNamespace(vendor="postgresql", alias="default")
+        costs = {
+            ("inline", "inline"): 100,
+            ("materialized", "inline"): 90,
+            ("materialized", "materialized"): 95,
+            ("inline", "materialized"): 120,
+        }
+
+        def make_sql(choices):
+            return (choices["a"], choices["b"])
+
+        def estimate_cost(connection, sql, params):
+            return costs[sql]
+
+        def choose():
+            return strategy.choose_strategies(
+                pg, "key", ["a", "b"], make_sql, ())
+
+        with patch.object(strategy, "estimate_cost", estimate_cost):
+            with override_settings(CTE_STRATEGY_CACHE_TTL=0):
+                self.assertEqual(choose(), {"a": "materialized", "b": "inline"})
+                costs[("materialized", "inline")] = 110
+                self.assertEqual(choose(), {"a": "inline", "b": "inline"})
+
+            # cached decision
+            self.assertEqual(choose(), {"a": "inline", "b": "inline"})
+            costs[("materialized", "inline")] = 90
+            self.assertEqual(choose(), {"a": "inline", "b": "inline"})
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            CTE(Order.objects.all(), strategy="bogus")
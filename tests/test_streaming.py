@@ -0,0 +1,177 @@
+import gc
+from unittest import mock
+
+from django.db import connection, connections
+from django.db.models import IntegerField, TextField, Value
+from django.db.models.aggregates import Sum
+from django.test import TestCase
+
+from django_cte import CTE, with_cte
+from django_cte.raw import raw_cte_sql
+from django_cte.streaming import stream
+from django_cte.temptable import get_reused_ctes
+
+from .models import Order, Region
+
+int_field = IntegerField()
+text_field = TextField()
+
+
+class TestStream(TestCase):
+
+    def setUp(self):
+        raw = connections["default"]
+        patcher = mock.patch.object(
+            raw, "chunked_cursor", wraps=raw.chunked_cursor)
+        self.chunked_cursor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_recursive_cte(self):
+        def make_regions_cte(cte):
+            return Region.objects.filter(parent__isnull=True).values(
+                "name",
+                depth=Value(0, output_field=int_field),
+            ).union(
+                cte.join(Region, parent=cte.col.name).values(
+                    "name",
+                    depth=cte.col.depth + Value(1, output_field=int_field),
+                ),
+                all=True,
+            )
+
+        cte = CTE.recursive(make_regions_cte)
+        regions = with_cte(
+            cte,
+            select=cte.join(Region, name=cte.col.name)
+            .annotate(depth=cte.col.depth)
+            .order_by("depth", "name")
+        )
+        print(regions.query)
+
+        progress = []
+        data = [(r.name, r.depth) for r in stream(
+            regions, chunk_size=4, progress=progress.append)]
+        self.assertEqual(data, [(r.name, r.depth) for r in regions])
+        self.assertEqual(
+            progress,
+            list(range(4, len(data), 4)) + [len(data)],
+        )
+        self.chunked_cursor.assert_called_once()
+
+    def test_raw_cte(self):
+        cte = CTE(raw_cte_sql(
+            """
+            SELECT region_id, SUM(amount) AS total
+            FROM orders GROUP BY region_id
+            """,
+            [],
+            {"region_id": text_field, "total": int_field},
+        ))
+        regions = with_cte(
+            cte,
+            select=cte.join(Region, name=cte.col.region_id)
+            .annotate(total=cte.col.total)
+            .values_list("name", "total")
+            .order_by("name")
+        )
+        print(regions.query)
+
+        self.assertEqual(list(stream(regions, chunk_size=2)), list(regions))
+        self.chunked_cursor.assert_called_once()
+
+    def test_temp_table_strategy(self):
+        cte = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+            strategy="temp_table",
+        )
+        regions = with_cte(
+            cte,
+            select=cte.join(Region, name=cte.col.region_id)
+            .annotate(total=cte.col.total)
+            .values_list("name", "total")
+            .order_by("name")
+        )
+        expected = list(regions)
+
+        self.assertEqual(list(stream(regions, chunk_size=2)), expected)
+        self.chunked_cursor.assert_called_once()
+        self.assertNotIn(
+            "totals", connection.introspection.table_names())
+
+    def test_explain(self):
+        cte = CTE(Order.objects.values("region_id", "amount"), name="amounts")
+        orders = with_cte(
+            cte,
+            select=cte.queryset().values_list("amount", flat=True)
+            .order_by("amount")
+        )
+        orders.explain()
+        self.assertEqual(
+            list(stream(orders, chunk_size=5)),
+            sorted(Order.objects.values_list("amount", flat=True)),
+        )
+
+    def test_close_before_exhausted(self):
+        cte = CTE(Order.objects.values("amount"), name="amounts")
+        orders = with_cte(
+            cte,
+            select=cte.queryset().values_list("amount", flat=True)
+            .order_by("amount")
+        )
+        progress = []
+        items = stream(orders, chunk_size=2, progress=progress.append)
+        self.assertEqual([next(items) for _ in range(3)], [1, 2, 3])
+        items.close()
+        self.assertEqual(progress, [2])
+        self.assertTrue(Order.objects.exists())
+
+    def test_abandoned_before_exhausted(self):
+        cte = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+            strategy="temp_table",
+        )
+        regions = with_cte(
+            cte,
+            select=cte.join(Region, name=cte.col.region_id)
+            .values_list("name", flat=True)
+            .order_by("name")
+        )
+        atomic_blocks = len(connection.atomic_blocks)
+        items = stream(regions, chunk_size=2)
+        self.assertEqual(next(items), "earth")
+        self.assertEqual(len(connection.atomic_blocks), atomic_blocks + 1)
+        self.assertEqual(get_reused_ctes("default"), {})
+        del items
+        gc.collect()
+        self.assertEqual(len(connection.atomic_blocks), atomic_blocks)
+        self.assertNotIn(
+            "totals", connection.introspection.table_names())
+        self.assertTrue(Order.objects.exists())
+
+    def test_error_rolls_back(self):
+        orders = with_cte(
+            CTE(Order.objects.values("amount"), name="amounts"),
+            select=Order.objects.order_by("amount"),
+        )
+        atomic_blocks = len(connection.atomic_blocks)
+        items = stream(orders, chunk_size=2)
+        next(items)
+        with self.assertRaises(ZeroDivisionError):
+            items.throw(ZeroDivisionError)
+        self.assertEqual(len(connection.atomic_blocks), atomic_blocks)
+        self.assertTrue(Order.objects.exists())
+
+    def test_empty(self):
+        progress = []
+        orders = with_cte(
+            CTE(Order.objects.none(), name="none"),
+            select=Order.objects.filter(amount__lt=0),
+        )
+        self.assertEqual(list(stream(orders, progress=progress.append)), [])
+        self.assertEqual(progress, [0])
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            stream(Order.objects.all(), chunk_size=0)
@@ -0,0 +1,181 @@
+from django.db.models import (
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    TextField,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.aggregates import Sum
+from django.db.models.sql.subqueries import UpdateQuery
+from django.test import TestCase
+
+from django_cte import CTE, with_cte
+from django_cte.raw import raw_cte_sql
+from django_cte.tables import get_dependencies
+
+from .models import Order, Region, User
+
+
+class TestTableDependencies(TestCase):
+
+    def test_cte_query(self):
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        regions = with_cte(
+            totals,
+            select=totals.join(Region, name=totals.col.region_id)
+            .annotate(total=totals.col.total)
+        )
+        read, written = get_dependencies(regions)
+        self.assertEqual(read, {"orders", "region"})
+        self.assertEqual(written, set())
+
+    def test_nested_ctes_subqueries_and_unions(self):
+        users = CTE(User.objects.values("id"), name="users")
+        orders = CTE(
+            with_cte(users, select=Order.objects.filter(
+                user_id__in=users.queryset().values("id")
+            )).values("region_id"),
+            name="orders_cte",
+        )
+        regions = with_cte(
+            orders,
+            select=Region.objects.filter(
+                name__in=orders.queryset().values("region_id")
+            ).values("name").union(
+                Order.objects.annotate(name=F("region__parent_id"))
+                .values("name")
+            )
+        )
+        self.assertEqual(
+            get_dependencies(regions.query).read,
+            {"user", "orders", "region"},
+        )
+
+    def test_cte(self):
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        self.assertEqual(get_dependencies(totals), ({"orders"}, set()))
+
+    def test_recursive_cte(self):
+        def make_regions_cte(cte):
+            return Region.objects.filter(parent__isnull=True).values(
+                "name",
+            ).union(
+                cte.join(Region, parent=cte.col.name).values("name"),
+                all=True,
+            )
+
+        cte = CTE.recursive(make_regions_cte, name="regions")
+        self.assertEqual(get_dependencies(cte), ({"region"}, set()))
+        regions = with_cte(cte, select=cte.queryset())
+        self.assertEqual(get_dependencies(regions), ({"region"}, set()))
+
+    def test_cte_referencing_other_cte(self):
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        large = CTE(totals.queryset().filter(total__gt=100), name="large")
+        self.assertEqual(get_dependencies(large), ({"orders"}, set()))
+        joined = CTE(
+            totals.join(Region, name=totals.col.region_id).values("name"),
+            name="joined",
+        )
+        self.assertEqual(
+            get_dependencies(joined), ({"orders", "region"}, set()))
+        regions = with_cte(
+            totals, large,
+            select=large.join(Region, name=large.col.region_id),
+        )
+        self.assertEqual(
+            get_dependencies(regions), ({"orders", "region"}, set()))
+
+    def test_raw_cte(self):
+        cte = CTE(raw_cte_sql(
+            "SELECT region_id, SUM(amount) AS total FROM orders "
+            "GROUP BY region_id",
+            [],
+            {"region_id": TextField(), "total": IntegerField()},
+            reads=["orders"],
+        ))
+        regions = with_cte(cte, select=cte.join(Region, name=cte.col.region_id))
+        self.assertEqual(
+            get_dependencies(regions),
+            ({"orders", "region"}, set()),
+        )
+
+    def test_raw_cte_with_undeclared_dependencies(self):
+        cte = CTE(raw_cte_sql(
+            "SELECT name FROM region", [], {"name": TextField()}))
+        regions = with_cte(cte, select=cte.join(Region, name=cte.col.name))
+        with self.assertRaisesRegex(ValueError, "reads="):
+            get_dependencies(regions)
+
+    def test_data_modifying_raw_cte(self):
+        cte = CTE(raw_cte_sql(
+            "DELETE FROM orders WHERE amount > %s RETURNING region_id",
+            [100],
+            {"region_id": TextField()},
+            reads=["orders"],
+            writes=["orders"],
+        ))
+        regions = with_cte(
+            cte, select=cte.join(Region, name=cte.col.region_id))
+        self.assertEqual(
+            get_dependencies(regions),
+            ({"orders", "region"}, {"orders"}),
+        )
+
+    def test_update_query(self):
+        totals = CTE(
+            Order.objects.values("region_id").annotate(total=Sum("amount")),
+            name="totals",
+        )
+        query = with_cte(totals, select=Region.objects.all()).query
+        query = query.chain(UpdateQuery)
+        query.add_update_values({"parent_id": Subquery(
+            User.objects.filter(name=OuterRef("name")).values("name")[:1]
+        )})
+        read, written = get_dependencies(query)
+        self.assertEqual(read, {"orders", "region", "user"})
+        self.assertEqual(written, {"region"})
+
+    def test_subqueries_outside_of_where(self):
+        users = User.objects.filter(name=OuterRef("name")).values("name")[:1]
+        orders = Order.objects.filter(region_id=OuterRef("name"))
+        cases = {
+            "order_by": Region.objects.order_by(Subquery(users)),
+            "values": Region.objects.values(user=Subquery(users)),
+            "group_by": Region.objects.values(user=Subquery(users))
+            .annotate(total=Sum("parent_id")),
+            "alias": Region.objects.alias(has_orders=Exists(orders))
+            .order_by("has_orders"),
+        }
+        for name, queryset in cases.items():
+            with self.subTest(name):
+                read = get_dependencies(queryset).read
+                self.assertIn("region", read)
+                self.assertTrue(read & {"user", "orders"}, read)
+
+    def test_raw_sql(self):
+        cases = {
+            "RawSQL": Region.objects.annotate(
+                n=RawSQL("SELECT COUNT(*) FROM orders", [])),
+            "order_by RawSQL": Region.objects.order_by(
+                RawSQL("SELECT COUNT(*) FROM orders", [])),
+            "extra select": Region.objects.extra(
+                select={"n": "SELECT COUNT(*) FROM orders"}),
+            "extra where": Region.objects.extra(
+                where=["name IN (SELECT name FROM user)"]),
+        }
+        for name, queryset in cases.items():
+            with self.subTest(name):
+                with self.assertRaisesRegex(ValueError, "Unknown table"):
+                    get_dependencies(queryset)
@@ -0,0 +1,204 @@
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.db.models.aggregates import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_cte import CTE, with_cte
+from django_cte.temptable import reuse_ctes
+
+from . import region_totals
+from .models import Order, Region
+
+
+class TestTempTableStrategy(TestCase):
+
+    def test_temp_table(self):
+        planets = CTE(
+            Region.objects.filter(parent="sun").values("name"),
+            name="planets",
+        )
+        totals = CTE(
+            Order.objects
+            .filter(region__in=planets.queryset().values("name"))
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+            strategy="temp_table",
+            indexes=["region_id"],
+        )
+        regions = with_cte(
+            planets,
+            totals,
+            select=totals.join(Region, name=totals.col.region_id)
+            .annotate(total=totals.col.total)
+            .order_by("name")
+        )
+        print(regions.query)
+        self.assertIn('"totals" AS MATERIALIZED (', str(regions.query))
+
+        with CaptureQueriesContext(connection) as queries:
+            data = [(r.name, r.total) for r in regions]
+        self.assertEqual(data, [
+            ('earth', 126),
+            ('mars', 123),
+            ('mercury', 33),
+            ('venus', 86),
+        ])
+        sqls = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        print("\n".join(sqls))
+        self.assertTrue(sqls[0].startswith(
+            'CREATE TEMPORARY TABLE "totals" AS WITH RECURSIVE "planets" AS'
+        ), sqls[0])
+        self.assertEqual(
+            sqls[1],
+            'CREATE INDEX "totals_region_id_idx" ON "totals" ("region_id")',
+        )
+        self.assertEqual(sqls[2], 'ANALYZE "totals"')
+        self.assertTrue(sqls[3].startswith(
+            'WITH RECURSIVE "planets" AS (SELECT'), sqls[3])
+        self.assertNotIn('"totals" AS', sqls[3])
+        self.assertIn('INNER JOIN "totals"', sqls[3])
+        self.assertEqual(sqls[4], 'DROP TABLE "totals"')
+
+        # table was dropped: can be executed again
+        self.assertEqual(len(list(regions)), 4)
+
+    def test_temp_table_referencing_temp_table(self):
+        planets = CTE(
+            Region.objects.filter(parent="sun").values("name"),
+            name="planets",
+            strategy="temp_table",
+        )
+        totals = CTE(
+            Order.objects
+            .filter(region__in=planets.queryset().values("name"))
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+            strategy="temp_table",
+            indexes=["region_id"],
+        )
+        regions = with_cte(
+            planets,
+            totals,
+            select=totals.join(Region, name=totals.col.region_id)
+            .annotate(total=totals.col.total)
+            .order_by("name")
+        )
+        with CaptureQueriesContext(connection) as queries:
+            data = [(r.name, r.total) for r in regions.iterator()]
+        self.assertEqual(data[0], ('earth', 126))
+        sqls = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        print("\n".join(sqls))
+        creates = [s for s in sqls if s.startswith("CREATE TEMPORARY TABLE")]
+        self.assertEqual(len(creates), 2, creates)
+        self.assertTrue(creates[0].startswith(
+            'CREATE TEMPORARY TABLE "planets" AS SELECT'), creates[0])
+        self.assertTrue(creates[1].startswith(
+            'CREATE TEMPORARY TABLE "totals" AS SELECT'), creates[1])
+        self.assertEqual(
+            sqls[-2:],
+            ['DROP TABLE "totals"', 'DROP TABLE "planets"'],
+        )
+
+    def test_temp_table_values(self):
+        regions = region_totals(strategy="temp_table") \
+            .values_list("name", "total")
+        self.assertEqual(regions.count(), 4)
+        self.assertEqual(list(regions)[0], ('earth', 126))
+
+    def test_indexes_require_temp_table_strategy(self):
+        with self.assertRaises(ValueError):
+            CTE(Order.objects.all(), indexes=["region_id"])
+
+
+class TestReuseCTEs(TestCase):
+
+    def test_reuse_ctes(self):
+        totals = CTE(
+            Order.objects
+            .filter(region__parent="sun")
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+        )
+        regions = with_cte(
+            totals,
+            select=totals.join(Region, name=totals.col.region_id)
+            .annotate(total=totals.col.total)
+            .order_by("name")
+        )
+        big = with_cte(totals, select=totals).filter(total__gt=100)
+
+        with CaptureQueriesContext(connection) as queries:
+            with reuse_ctes(totals):
+                data = [(r.name, r.total) for r in regions]
+                big_regions = sorted(r["region_id"] for r in big)
+                count = regions.count()
+        self.assertEqual(data, [
+            ('earth', 126),
+            ('mars', 123),
+            ('mercury', 33),
+            ('venus', 86),
+        ])
+        self.assertEqual(big_regions, ["earth", "mars"])
+        self.assertEqual(count, 4)
+
+        sqls = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        print("\n".join(sqls))
+        creates = [s for s in sqls if s.startswith("CREATE TEMPORARY TABLE")]
+        self.assertEqual(len(creates), 1, sqls)
+        self.assertTrue(creates[0].startswith(
+            'CREATE TEMPORARY TABLE "totals" AS SELECT'), creates[0])
+        self.assertFalse(
+            [s for s in sqls if '"totals" AS (' in s and "CREATE" not in s],
+            sqls,
+        )
+        self.assertEqual(sqls[-1], 'DROP TABLE IF EXISTS "totals"')
+
+        # CTE is evaluated after exiting the context
+        self.assertIn('"totals" AS (', str(big.query))
+        self.assertEqual(big.count(), 2)
+
+    def test_reuse_hoisted_cte(self):
+        totals = CTE(
+            Order.objects
+            .filter(region__parent="sun")
+            .values("region_id")
+            .annotate(total=Sum("amount")),
+            name="totals",
+        )
+        subquery = (
+            with_cte(totals, select=totals)
+            .filter(region_id=OuterRef("name"))
+            .values("total")
+        )
+        regions = with_cte(
+            select=Region.objects
+            .annotate(total=Subquery(subquery[:1]))
+            .filter(parent="sun")
+            .order_by("name")
+        )
+        with CaptureQueriesContext(connection) as queries:
+            with reuse_ctes(totals):
+                data = [(r.name, r.total) for r in regions]
+                list(regions)
+        self.assertEqual(data[0], ('earth', 126))
+        sqls = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        creates = [s for s in sqls if s.startswith("CREATE TEMPORARY TABLE")]
+        self.assertEqual(len(creates), 1, sqls)
+        self.assertFalse([s for s in sqls if "WITH RECURSIVE" in s], sqls)
+
+    def test_unused_cte_is_not_created(self):
+        with CaptureQueriesContext(connection) as queries:
+            with reuse_ctes(CTE(Order.objects.all(), name="totals")):
+                list(Region.objects.all())
+        self.assertEqual(len(queries), 1)
+
+    def test_duplicate_names(self):
+        totals = CTE(Order.objects.all(), name="totals")
+        other = CTE(Order.objects.all(), name="totals")
+        with self.assertRaises(ValueError):
+            with reuse_ctes(totals, other):
+                pass
@@ -0,0 +1,60 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase
+
+from django_cte.testing import assert_plan_snapshot, plan_shape
+
+from . import region_totals
+
+
+class TestPlanSnapshot(TestCase):
+
+    def test_plan_shape(self):
+        shape = plan_shape(region_totals(materialized=True))
+        print("\n".join(shape))
+        if connection.vendor == "postgresql":
+            self.assertIn("  CTE totals: Aggregate", shape)
+            # the scan type depends on the server version and statistics
+            self.assertTrue(
+                any(line.endswith(" on orders") for line in shape),
+                shape,
+            )
+            self.assertTrue(
+                any("CTE Scan on totals" in line for line in shape),
+                shape,
+            )
+        else:
+            self.assertIn("MATERIALIZE totals", shape)
+        self.assertFalse(any("cost" in line.lower() for line in shape), shape)
+
+    def test_snapshot(self):
+        with TemporaryDirectory() as tmp:
+            assert_plan_snapshot(
+                region_totals(materialized=True), "totals", tmp)
+            path = os.path.join(tmp, f"totals.{connection.vendor}.json")
+            with open(path) as fh:
+                snapshot = json.load(fh)
+            self.assertIn('WITH RECURSIVE "totals" AS', snapshot["sql"])
+            self.assertEqual(snapshot["params"], ["'sun'"])
+            self.assertIn("totals", "\n".join(snapshot["plan"]))
+
+            # unchanged plan
+            assert_plan_snapshot(
+                region_totals(materialized=True), "totals", tmp)
+
+            # CTE no longer filtered by an index
+            with self.assertRaisesRegex(AssertionError, "differs from snap"):
+                assert_plan_snapshot(
+                    region_totals(parent=None, materialized=True), "totals", tmp,
+                    update=False,
+                )
+
+            with patch.dict(os.environ, {"CTE_UPDATE_PLAN_SNAPSHOTS": "1"}):
+                assert_plan_snapshot(
+                    region_totals(parent=None, materialized=True), "totals", tmp)
+            assert_plan_snapshot(
+                region_totals(parent=None, materialized=True), "totals", tmp)